@@ -0,0 +1,329 @@
+"""
+The sidecar index that the assembler uses for incremental re-assembly.
+"""
+import array
+import difflib
+import itertools
+import json
+import os
+import re
+import sys
+import typing
+import zlib
+from Parser import Parser, A_COMMAND, L_COMMAND
+from SymbolTable import SymbolTable
+from Code import Code
+
+
+class AssemblyIndex:
+    """The sidecar index of an assembled file, which lets the next assembly
+    of the file re-encode only the lines that changed since.
+
+    For every source line the index keeps a hash of the line, its kind and
+    its symbol, and for the whole program it keeps the encoded words and the
+    addresses of all the symbols. Lines are matched against the previous
+    source by their hashes, the words of unchanged lines are copied over as
+    they are, and only the lines in between are tokenized and encoded. An
+    A-instruction that references a symbol is rewritten only if the address
+    of the symbol changed, e.g. because lines were inserted before a label
+    or because the first use of a variable moved.
+    """
+
+    FORMAT_VERSION = 1
+    EXTENSION = ".asmidx"
+
+    # line kinds: nothing, a constant word (a C-instruction or a numeric
+    # A-instruction), an A-instruction with a symbol, and a label
+    BLANK = '-'
+    WORD = 'w'
+    SYMBOL = 'a'
+    LABEL = 'l'
+
+    # line kind -> the number of instructions on the line, as a bytes table
+    __instruction_counts = bytes.maketrans(
+        (BLANK + WORD + SYMBOL + LABEL).encode(), bytes((0, 1, 1, 0)))
+
+    # line kind -> 1 for A-instructions with a symbol, and 0 otherwise
+    __references = bytes.maketrans(
+        (BLANK + WORD + SYMBOL + LABEL).encode(), bytes((0, 0, 1, 0)))
+
+    # above this many lines on either side, changes are not diffed line by
+    # line, and the whole changed region is encoded again
+    MAX_DIFF_LINES = 1 << 14
+
+    def __init__(self, hashes: typing.List[int], kinds: str,
+                 symbols: typing.List[str], words: array.array,
+                 addresses: typing.Dict[str, int]) -> None:
+        """Creates a new index.
+
+        Args:
+            hashes (typing.List[int]): the hash of every source line.
+            kinds (str): the kind of every source line, one character each.
+            symbols (typing.List[str]): the symbol of every source line, or
+                an empty string for lines without one.
+            words (array.array): the machine words of the program.
+            addresses (typing.Dict[str, int]): the address of every symbol.
+        """
+        self.hashes = hashes
+        self.kinds = kinds
+        self.symbols = symbols
+        self.words = words
+        self.addresses = addresses
+        # statistics of the assembly that built the index
+        self.encoded_lines = 0
+        self.rewritten_references = 0
+
+    @staticmethod
+    def path_for(input_path: str) -> str:
+        """
+        Args:
+            input_path (str): path of an .asm file.
+
+        Returns:
+            str: path of the sidecar index of the file.
+        """
+        return os.path.splitext(input_path)[0] + AssemblyIndex.EXTENSION
+
+    @staticmethod
+    def hash_line(line: bytes) -> int:
+        """
+        Args:
+            line (bytes): a source line.
+
+        Returns:
+            int: a 64-bit hash of the line that is stable across runs.
+        """
+        return zlib.crc32(line) << 32 | zlib.adler32(line)
+
+    @staticmethod
+    def rom_addresses(kinds: str) -> typing.List[int]:
+        """
+        Args:
+            kinds (str): the kinds of the lines of a source.
+
+        Returns:
+            typing.List[int]: the ROM address of the instruction of every
+            line, or of the next instruction for lines without one, followed
+            by the size of the program.
+        """
+        rom = [0]
+        rom.extend(itertools.accumulate(
+            kinds.encode().translate(AssemblyIndex.__instruction_counts)))
+        return rom
+
+    @staticmethod
+    def load(index_path: str) -> typing.Optional["AssemblyIndex"]:
+        """
+        Args:
+            index_path (str): path of a sidecar index.
+
+        Returns:
+            typing.Optional[AssemblyIndex]: the index, or None if there is
+            none, or if it is unreadable or was built by another encoder.
+        """
+        try:
+            with open(index_path, 'r') as index_file:
+                data = json.loads(index_file.read())
+            if data["format"] != AssemblyIndex.FORMAT_VERSION or \
+                    data["encoder"] != Code.fingerprint():
+                return None
+            hashes = array.array('Q', bytes.fromhex(data["hashes"]))
+            words = array.array('H', bytes.fromhex(data["words"]))
+            if sys.byteorder != "little":
+                hashes.byteswap()
+                words.byteswap()
+            kinds = data["kinds"]
+            symbols = data["symbols"].split("\n") if kinds else []
+            return AssemblyIndex(hashes.tolist(), kinds, symbols, words,
+                                 data["addresses"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, index_path: str) -> None:
+        """Writes the index atomically, so a crash never leaves a partial
+        index behind. The hashes and the words are stored as little-endian
+        hex blobs, and the symbols as a single string, which are much faster
+        to read and write than JSON lists.
+
+        Args:
+            index_path (str): path of the sidecar index.
+        """
+        hashes = array.array('Q', self.hashes)
+        words = array.array('H', self.words)
+        if sys.byteorder != "little":
+            hashes.byteswap()
+            words.byteswap()
+        temporary_path = index_path + ".tmp"
+        with open(temporary_path, 'w') as index_file:
+            index_file.write(json.dumps(
+                {"format": AssemblyIndex.FORMAT_VERSION,
+                 "encoder": Code.fingerprint(),
+                 "hashes": hashes.tobytes().hex(),
+                 "kinds": self.kinds,
+                 "symbols": "\n".join(self.symbols),
+                 "words": words.tobytes().hex(),
+                 "addresses": self.addresses},
+                separators=(',', ':')))
+        os.replace(temporary_path, index_path)
+
+    @staticmethod
+    def diff(old_hashes: typing.List[int], new_hashes: typing.List[int]
+             ) -> typing.List[typing.Tuple[str, int, int, int, int]]:
+        """Matches the lines of two versions of a source.
+
+        Args:
+            old_hashes (typing.List[int]): the line hashes of the old source.
+            new_hashes (typing.List[int]): the line hashes of the new source.
+
+        Returns:
+            typing.List[typing.Tuple[str, int, int, int, int]]: opcodes in
+            the format of difflib.SequenceMatcher.get_opcodes(), except that
+            all the changes are reported as "replace".
+        """
+        old_count, new_count = len(old_hashes), len(new_hashes)
+        # the common prefix and suffix are found without difflib, which is
+        # all it takes when a single region of the file was edited
+        prefix = AssemblyIndex.__common_prefix(old_hashes, new_hashes)
+        suffix = AssemblyIndex.__common_prefix(old_hashes[prefix:][::-1],
+                                               new_hashes[prefix:][::-1])
+        old_end, new_end = old_count - suffix, new_count - suffix
+
+        opcodes = []
+        if prefix:
+            opcodes.append(("equal", 0, prefix, 0, prefix))
+        if prefix < old_end or prefix < new_end:
+            if old_end - prefix > AssemblyIndex.MAX_DIFF_LINES or \
+                    new_end - prefix > AssemblyIndex.MAX_DIFF_LINES:
+                opcodes.append(("replace", prefix, old_end, prefix, new_end))
+            else:
+                matcher = difflib.SequenceMatcher(
+                    None, old_hashes[prefix:old_end],
+                    new_hashes[prefix:new_end])
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                    opcodes.append(("equal" if tag == "equal" else "replace",
+                                    prefix + i1, prefix + i2,
+                                    prefix + j1, prefix + j2))
+        if suffix:
+            opcodes.append(("equal", old_end, old_count, new_end, new_count))
+        return opcodes
+
+    @staticmethod
+    def __common_prefix(old: typing.List[int], new: typing.List[int]) -> int:
+        """Finds the length of the common prefix of two lists by bisection,
+        so the elements are compared by whole slices rather than one by one.
+        """
+        low, high = 0, min(len(old), len(new))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if old[low:middle] == new[low:middle]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    @staticmethod
+    def build(lines: typing.List[bytes],
+              previous: typing.Optional["AssemblyIndex"] = None
+              ) -> typing.Tuple["AssemblyIndex", SymbolTable]:
+        """Assembles a source, reusing whatever it can from the index of its
+        previous version.
+
+        Args:
+            lines (typing.List[bytes]): the lines of the source.
+            previous (typing.Optional[AssemblyIndex]): the index of the
+                previous version of the source, if there is one.
+
+        Returns:
+            typing.Tuple[AssemblyIndex, SymbolTable]: the index of the
+            source, whose words are the assembled program, and the symbol
+            table of the program.
+        """
+        # the same as hash_line, with the checksums computed by map
+        hashes = [crc << 32 | adler for crc, adler in
+                  zip(map(zlib.crc32, lines), map(zlib.adler32, lines))]
+        if previous is None:
+            opcodes = [("replace", 0, 0, 0, len(lines))]
+            old_rom = [0]
+        else:
+            opcodes = AssemblyIndex.diff(previous.hashes, hashes)
+            # the ROM address of the first instruction of every old line
+            old_rom = AssemblyIndex.rom_addresses(previous.kinds)
+
+        kinds = []
+        symbols = []
+        words = array.array('H')
+        encoded_lines = 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                kinds.append(previous.kinds[i1:i2])
+                symbols.extend(previous.symbols[i1:i2])
+                words.extend(previous.words[old_rom[i1]:old_rom[i2]])
+                continue
+            span_kinds = [AssemblyIndex.BLANK] * (j2 - j1)
+            span_symbols = [''] * (j2 - j1)
+            source = [line.decode() for line in lines[j1:j2]]
+            for instruction in Parser.lex(source):
+                line = instruction.line - 1
+                command_type = instruction.command_type
+                if command_type == L_COMMAND:
+                    span_kinds[line] = AssemblyIndex.LABEL
+                    span_symbols[line] = instruction.symbol
+                elif command_type == A_COMMAND and \
+                        not instruction.symbol.isdigit():
+                    span_kinds[line] = AssemblyIndex.SYMBOL
+                    span_symbols[line] = instruction.symbol
+                    # patched below, once the symbol is resolved
+                    words.append(0)
+                elif command_type == A_COMMAND:
+                    span_kinds[line] = AssemblyIndex.WORD
+                    words.append(int(instruction.symbol) & 0x7FFF)
+                else:
+                    span_kinds[line] = AssemblyIndex.WORD
+                    words.append(Code.encode_C(instruction.dest,
+                                               instruction.comp,
+                                               instruction.jump))
+                encoded_lines += 1
+            kinds.append("".join(span_kinds))
+            symbols.extend(span_symbols)
+        kinds = "".join(kinds)
+
+        # labels first and variables in order of first use, exactly like the
+        # two passes of the assembler do
+        rom = AssemblyIndex.rom_addresses(kinds)
+        symbol_table = SymbolTable()
+        for match in re.finditer(AssemblyIndex.LABEL, kinds):
+            line = match.start()
+            symbol_table.add_entry(symbols[line], rom[line])
+        is_reference = kinds.encode().translate(AssemblyIndex.__references)
+        for symbol in dict.fromkeys(itertools.compress(symbols,
+                                                       is_reference)):
+            symbol_table.resolve_or_allocate(symbol)
+        names, addresses, _ = symbol_table.export()
+        addresses = dict(zip(names, addresses))
+
+        # only the references to symbols whose address changed, and the
+        # references on new lines, are rewritten
+        old_addresses = previous.addresses if previous is not None else {}
+        moved = {symbol for symbol, address in addresses.items()
+                 if old_addresses.get(symbol) != address}
+        rewritten_references = 0
+        if moved:
+            for line, symbol in zip(
+                    itertools.compress(range(len(kinds)), is_reference),
+                    itertools.compress(symbols, is_reference)):
+                if symbol in moved:
+                    words[rom[line]] = addresses[symbol] & 0x7FFF
+                    rewritten_references += 1
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                continue
+            for line in range(j1, j2):
+                symbol = symbols[line]
+                if is_reference[line] and symbol not in moved:
+                    words[rom[line]] = addresses[symbol] & 0x7FFF
+                    rewritten_references += 1
+
+        index = AssemblyIndex(hashes, kinds, symbols, words, addresses)
+        index.encoded_lines = encoded_lines
+        index.rewritten_references = rewritten_references
+        return index, symbol_table
@@ -0,0 +1,281 @@
+"""
+Benchmarks the assembler of project 6 on generated programs.
+"""
+import argparse
+import array
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import typing
+from SymbolTable import SymbolTable
+from Parser import Parser
+from Code import Code
+import Main
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+##### constants #####
+
+# the mnemonics the generator picks from
+DESTS = ("M", "D", "MD", "A", "AM", "AD", "AMD")
+COMPS = ("0", "1", "-1", "D", "A", "!D", "!A", "-D", "-A", "D+1", "A+1",
+         "D-1", "A-1", "D+A", "D-A", "A-D", "D&A", "D|A", "M", "!M", "-M",
+         "M+1", "M-1", "D+M", "D-M", "M-D", "D&M", "D|M")
+# the extended shift instructions, see Code.shift_commad
+SHIFT_COMPS = ("D<<", "A<<", "M<<", "D>>", "A>>", "M>>")
+JUMPS = ("JGT", "JEQ", "JGE", "JLT", "JNE", "JLE", "JMP")
+PREDEFINED = ("SP", "LCL", "ARG", "THIS", "THAT", "R13", "R14", "R15",
+              "SCREEN", "KBD")
+
+# default program sizes, in instructions
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def generate_program(size: int, label_density: float = 0.05,
+                     a_ratio: float = 0.5, shift_share: float = 0.05,
+                     variables: int = 50, seed: int = 0) -> str:
+    """Generates a random, valid Hack assembly program.
+
+    Args:
+        size (int): the number of instructions in the program.
+        label_density (float): the number of labels per instruction.
+        a_ratio (float): the share of A-instructions among the instructions.
+        shift_share (float): the share of shift instructions among the
+            C-instructions.
+        variables (int): the number of distinct variables that are used.
+        seed (int): the seed of the generator, so programs are reproducible.
+
+    Returns:
+        str: the source of the program.
+    """
+    generator = random.Random(seed)
+    label_count = round(size * label_density)
+    label_positions = set(generator.sample(range(size),
+                                           min(label_count, size)))
+    label_count = len(label_positions)
+    lines = []
+    next_label = 0
+    for position in range(size):
+        if position in label_positions:
+            lines.append(f"(LABEL{next_label})")
+            next_label += 1
+        if generator.random() < a_ratio:
+            kind = generator.random()
+            if label_count and kind < 0.4:
+                symbol = f"LABEL{generator.randrange(label_count)}"
+            elif variables and kind < 0.7:
+                symbol = f"var{generator.randrange(variables)}"
+            elif kind < 0.8:
+                symbol = generator.choice(PREDEFINED)
+            else:
+                symbol = str(generator.randrange(1 << 15))
+            lines.append("@" + symbol)
+            continue
+        if generator.random() < shift_share:
+            comp = generator.choice(SHIFT_COMPS)
+        else:
+            comp = generator.choice(COMPS)
+        if generator.random() < 0.2:
+            lines.append(f"{comp};{generator.choice(JUMPS)}")
+        else:
+            lines.append(f"{generator.choice(DESTS)}={comp}")
+    return "\n".join(lines) + "\n"
+
+
+def peak_rss_kib() -> typing.Optional[int]:
+    """
+    Returns:
+        typing.Optional[int]: the peak resident set size of this process so
+        far in KiB, or None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, and everything else KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def time_call(function: typing.Callable[[], typing.Any],
+              repeat: int) -> typing.List[float]:
+    """
+    Args:
+        function (typing.Callable[[], typing.Any]): the code to time.
+        repeat (int): the number of times to run it.
+
+    Returns:
+        typing.List[float]: the wall time of every run, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_program(source: str, repeat: int = 5
+                      ) -> typing.Dict[str, typing.Any]:
+    """Times the stages of the assembler on a single program.
+
+    Args:
+        source (str): the program.
+        repeat (int): the number of runs of every stage. The fastest run is
+            reported, along with the median.
+
+    Returns:
+        typing.Dict[str, typing.Any]: the results.
+    """
+    parser = Parser(io.StringIO(source))
+    instruction_count = sum(1 for instruction in parser.instructions()
+                            if instruction.command_type != Main.L_COMMAND)
+    code = Code()
+
+    def run_first_pass() -> None:
+        Main.first_pass(parser, SymbolTable())
+
+    # the second pass needs the labels of the first one, in a fresh table
+    second_pass_timings = []
+    for _ in range(repeat):
+        symbol_table = SymbolTable()
+        Main.first_pass(parser, symbol_table)
+        start = time.perf_counter()
+        Main.second_pass(parser, code, symbol_table)
+        second_pass_timings.append(time.perf_counter() - start)
+
+    def run_assemble_file() -> None:
+        Main.assemble_file(io.StringIO(source), io.StringIO())
+
+    stages = {"parse": time_call(lambda: Parser(io.StringIO(source)), repeat),
+              "first_pass": time_call(run_first_pass, repeat),
+              "second_pass": second_pass_timings,
+              "assemble_file": time_call(run_assemble_file, repeat)}
+
+    results = {"instructions": instruction_count, "stages": {}}
+    for stage, timings in stages.items():
+        best = min(timings)
+        results["stages"][stage] = {
+            "best_seconds": best,
+            "median_seconds": statistics.median(timings),
+            "instructions_per_second":
+                instruction_count / best if best else None}
+
+    def assemble_held() -> typing.Tuple[Parser, SymbolTable, array.array]:
+        held_parser = Parser(io.StringIO(source))
+        symbol_table = SymbolTable()
+        Main.first_pass(held_parser, symbol_table)
+        return held_parser, symbol_table, Main.second_pass(
+            held_parser, code, symbol_table)
+
+    # the memory blocks still held after a whole assembly, counted without
+    # tracemalloc, whose own bookkeeping takes blocks too
+    blocks_before = sys.getallocatedblocks()
+    held = assemble_held()
+    blocks = sys.getallocatedblocks() - blocks_before
+    del held
+    # the peak traced bytes of a whole assembly
+    tracemalloc.start()
+    held = assemble_held()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del held
+    results["retained_blocks_per_instruction"] = \
+        blocks / instruction_count if instruction_count else None
+    results["traced_peak_bytes_per_instruction"] = \
+        traced_peak / instruction_count if instruction_count else None
+    results["peak_rss_kib"] = peak_rss_kib()
+    return results
+
+
+def run(sizes: typing.Iterable[int], label_density: float, a_ratio: float,
+        shift_share: float, variables: int, seed: int, repeat: int
+        ) -> typing.Dict[str, typing.Any]:
+    """Benchmarks generated programs of all the given sizes.
+
+    Args:
+        sizes (typing.Iterable[int]): the program sizes, in instructions.
+        label_density (float): see generate_program.
+        a_ratio (float): see generate_program.
+        shift_share (float): see generate_program.
+        variables (int): see generate_program.
+        seed (int): see generate_program.
+        repeat (int): see benchmark_program.
+
+    Returns:
+        typing.Dict[str, typing.Any]: the results, with enough metadata to
+        compare them with the results of other runs.
+    """
+    results = {"python": platform.python_version(),
+               "implementation": platform.python_implementation(),
+               "machine": platform.machine(),
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "encoder_version": Code.ENCODER_VERSION,
+               "parameters": {"label_density": label_density,
+                              "a_ratio": a_ratio,
+                              "shift_share": shift_share,
+                              "variables": variables,
+                              "seed": seed,
+                              "repeat": repeat},
+               "programs": []}
+    # the peak RSS only grows, so smaller programs go first
+    for size in sorted(sizes):
+        source = generate_program(size, label_density, a_ratio, shift_share,
+                                  variables, seed)
+        program_results = benchmark_program(source, repeat)
+        program_results["size"] = size
+        results["programs"].append(program_results)
+    return results
+
+
+if "__main__" == __name__:
+    # Generates programs of the given sizes, benchmarks the assembler on
+    # them, and prints a summary. The full results are written as JSON.
+    argument_parser = argparse.ArgumentParser(
+        prog="Benchmark",
+        description="Benchmarks the assembler on generated programs.")
+    argument_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+        help="program sizes, in instructions")
+    argument_parser.add_argument(
+        "--label-density", type=float, default=0.05,
+        help="labels per instruction")
+    argument_parser.add_argument(
+        "--a-ratio", type=float, default=0.5,
+        help="share of A-instructions")
+    argument_parser.add_argument(
+        "--shift-share", type=float, default=0.05,
+        help="share of shift instructions among the C-instructions")
+    argument_parser.add_argument(
+        "--variables", type=int, default=50,
+        help="number of distinct variables")
+    argument_parser.add_argument("--seed", type=int, default=0)
+    argument_parser.add_argument(
+        "--repeat", type=int, default=5, help="runs of every stage")
+    argument_parser.add_argument(
+        "--output", default=None, metavar="FILE",
+        help="write the results as JSON to this file (default: stdout)")
+    arguments = argument_parser.parse_args()
+
+    benchmark_results = run(arguments.sizes, arguments.label_density,
+                            arguments.a_ratio, arguments.shift_share,
+                            arguments.variables, arguments.seed,
+                            arguments.repeat)
+    for program in benchmark_results["programs"]:
+        summary = ", ".join(
+            f"{stage} {stage_results['instructions_per_second']:,.0f}/s"
+            for stage, stage_results in program["stages"].items()
+            if stage_results["instructions_per_second"] is not None)
+        print(f"{program['size']} instructions: {summary}", file=sys.stderr)
+    if arguments.output is None:
+        json.dump(benchmark_results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(benchmark_results, output_file, indent=2)
@@ -0,0 +1,120 @@
+"""
+An on-disk cache of assembled outputs, for the assembler of project 6.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from Code import Code
+
+
+class BuildCache:
+    """An on-disk cache of assembled outputs, keyed on the contents of the
+    .asm file and the version of the encoder.
+
+    Every entry is a single file named after its key. Hits refresh the
+    modification time of the entry, and when the cache grows past its size
+    limit the least recently used entries are evicted. Entries are written
+    to a temporary file and renamed into place, so concurrent assemblers can
+    share a cache directory safely.
+    """
+
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache",
+                                     "hack-assembler")
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY,
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """Creates a cache in the given directory.
+
+        Args:
+            directory (str): the cache directory, created if needed.
+            max_bytes (int): the total size the entries may take up.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(input_path: str, variant: str = "") -> str:
+        """
+        Args:
+            input_path (str): path of the .asm file.
+            variant (str): anything else that changes the output for the same
+                input, such as the output format.
+
+        Returns:
+            str: the cache key of the file.
+        """
+        digest = hashlib.sha256()
+        digest.update(Code.fingerprint().encode())
+        digest.update(b"\0" + variant.encode() + b"\0")
+        with open(input_path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def __entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Copies a cached output to the given path, if there is one.
+
+        Args:
+            key (str): the cache key.
+            output_path (str): where to put the output.
+
+        Returns:
+            bool: True on a hit, False on a miss.
+        """
+        entry_path = self.__entry_path(key)
+        try:
+            shutil.copyfile(entry_path, output_path)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key: str, output_path: str) -> None:
+        """Adds an output to the cache, and evicts old entries if needed.
+
+        Args:
+            key (str): the cache key.
+            output_path (str): the freshly assembled output.
+        """
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory,
+                                                      suffix=".tmp")
+        os.close(descriptor)
+        try:
+            shutil.copyfile(output_path, temporary_path)
+            os.replace(temporary_path, self.__entry_path(key))
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits in its
+        size limit.
+        """
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
@@ -5,6 +5,8 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import typing
+
 
 class Code:
     """Translates Hack assembly language mnemonics into binary codes."""
@@ -23,7 +25,10 @@ class Code:
                        "M-D":"1000111","D&M":"1000000","D|M":"1010101",  
                        "D<<": "0110000", "A<<": "0100000",
                   "M<<": "1100000", "D>>": "0010000", "A>>": "0000000",
-                  "M>>": "1000000"}
+                  "M>>": "1000000",
+                  # commutative forms, as emitted by the VM translator
+                  "A+D":"0000010","A&D":"0000000","A|D":"0010101",
+                  "M+D":"1000010","M&D":"1000000","M|D":"1010101"}
     __jump_table= {"null":"000","JGT":"001","JEQ":"010",
                       "JGE":"011","JLT":"100","JNE":"101",
                       "JLE":"110","JMP":"111"}
@@ -31,6 +36,26 @@ class Code:
                        "MD":"011","A":"100","AM":"101",
                        "AD":"110","AMD":"111"}
 
+    # the same tables, precompiled into the bit fields of a machine word
+    __comp_bits = {mnemonic: int(bits, 2) << 6
+                   for mnemonic, bits in __comp_table.items()}
+    __dest_bits = {mnemonic: int(bits, 2) << 3
+                   for mnemonic, bits in __dest_table.items()}
+    __jump_bits = {mnemonic: int(bits, 2)
+                   for mnemonic, bits in __jump_table.items()}
+    C_PREFIX = 0b111 << 13
+    SHIFT_PREFIX = 0b101 << 13
+
+    # memoized across the whole run: (dest, comp, jump) -> word, word -> text
+    __c_words = {}
+    __word_texts = {}
+
+    # number of words rendered and written at once
+    WRITE_CHUNK_SIZE = 1 << 16
+
+    # bump whenever the encoding changes in a way the tables do not show
+    ENCODER_VERSION = 1
+
     @staticmethod
     def dest(mnemonic: str) -> str:
         """
@@ -72,21 +97,109 @@ class Code:
 
     def A_command(self, symbol, symbol_table) -> str:
         '''translate the A instruction into binary code'''
-        if symbol.isdigit():
-            return ("0" + format(int(symbol), "015b"))
-        else:
-            return ("0" + format(int(symbol_table.get_address(symbol)), "015b"))
+        return Code.word_text(Code.encode_A(symbol, symbol_table))
             
     def C_command(self, dest, comp, jump) -> str:
         '''translate the C instruction into binary code'''
-        dest = Code.dest(dest)
-        comp = Code.comp(comp)
-        jump = Code.jump(jump)
-        return ("111" + comp + dest + jump)
+        return Code.word_text(Code.encode_C(dest, comp, jump))
     
     def shift_commad(self, dest, comp, jump) -> str:
         '''translate the shift instruction into binary code'''
-        dest = Code.dest(dest)
-        comp = Code.comp(comp)
-        jump = Code.jump(jump)
-        return ("101" + comp + dest + jump)
+        return Code.word_text(Code.encode_C(dest, comp, jump))
+
+    @staticmethod
+    def fingerprint() -> str:
+        """
+        Returns:
+            str: identifies the encoder, so that outputs of different
+            encoders are never mixed up: its version and all of its tables,
+            including the custom shift opcodes.
+        """
+        return repr((Code.ENCODER_VERSION,
+                     sorted(Code.__comp_table.items()),
+                     sorted(Code.__dest_table.items()),
+                     sorted(Code.__jump_table.items())))
+
+    @staticmethod
+    def encode_A(symbol: str, symbol_table) -> int:
+        """
+        Args:
+            symbol (str): a decimal constant, or a symbol. A symbol that is
+                not in the symbol table yet is allocated as a variable.
+            symbol_table (SymbolTable): the symbol table.
+
+        Returns:
+            int: the 16-bit machine word of the A-instruction @symbol.
+        """
+        if symbol.isdigit():
+            return int(symbol) & 0x7FFF
+        return symbol_table.resolve_or_allocate(symbol) & 0x7FFF
+
+    @staticmethod
+    def encode_C(dest: str, comp: str, jump: str) -> int:
+        """Encodes a C-instruction, or a shift instruction if comp is one of
+        the shift extensions. Results are memoized for the whole run.
+
+        Args:
+            dest (str): a dest mnemonic string.
+            comp (str): a comp mnemonic string.
+            jump (str): a jump mnemonic string.
+
+        Returns:
+            int: the 16-bit machine word of the instruction.
+        """
+        key = (dest, comp, jump)
+        word = Code.__c_words.get(key)
+        if word is None:
+            prefix = Code.SHIFT_PREFIX if "<<" in comp or ">>" in comp \
+                else Code.C_PREFIX
+            word = prefix | Code.__comp_bits[comp] \
+                | Code.__dest_bits[dest] | Code.__jump_bits[jump]
+            Code.__c_words[key] = word
+        return word
+
+    @staticmethod
+    def word_text(word: int) -> str:
+        """
+        Args:
+            word (int): a 16-bit machine word.
+
+        Returns:
+            str: the word as a line of the text .hack format, without the
+            newline.
+        """
+        text = Code.__word_texts.get(word)
+        if text is None:
+            text = Code.__word_texts[word] = format(word, "016b")
+        return text
+
+    @staticmethod
+    def render(words: typing.Sequence[int]) -> str:
+        """Renders encoded words in the text .hack format, one per line.
+        Every distinct word is formatted only once.
+
+        Args:
+            words (typing.Sequence[int]): 16-bit machine words.
+
+        Returns:
+            str: the text of the words, each followed by a newline.
+        """
+        if not words:
+            return ""
+        texts = Code.__word_texts
+        for word in set(words).difference(texts):
+            texts[word] = format(word, "016b")
+        return "\n".join(map(texts.__getitem__, words)) + "\n"
+
+    @staticmethod
+    def write_words(words: typing.Sequence[int],
+                    output_file: typing.TextIO) -> None:
+        """Writes encoded words to a text .hack file in large blocks.
+
+        Args:
+            words (typing.Sequence[int]): 16-bit machine words.
+            output_file (typing.TextIO): the output file.
+        """
+        for start in range(0, len(words), Code.WRITE_CHUNK_SIZE):
+            output_file.write(
+                Code.render(words[start:start + Code.WRITE_CHUNK_SIZE]))
@@ -0,0 +1,154 @@
+"""
+The binary .hack image format, for the assembler of project 6.
+"""
+import array
+import mmap
+import struct
+import sys
+import typing
+from Code import Code
+
+
+class HackImage:
+    """Reads and writes ROM images in the two .hack formats.
+
+    The text format has one 16-character binary word per line. The binary
+    format has a 12-byte header followed by the words as little-endian uint16:
+
+        offset 0:  magic b"HACK"
+        offset 4:  uint16 format version
+        offset 6:  uint16 flags (reserved, always 0)
+        offset 8:  uint32 number of words
+        offset 12: the words
+
+    Both formats hold exactly the same information, so converting between
+    them is lossless.
+    """
+
+    MAGIC = b"HACK"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHI")
+
+    @staticmethod
+    def is_binary(data: bytes) -> bool:
+        """
+        Args:
+            data (bytes): the first bytes of a file.
+
+        Returns:
+            bool: True if the data starts with a binary image header.
+        """
+        return data[:len(HackImage.MAGIC)] == HackImage.MAGIC
+
+    @staticmethod
+    def write_binary(words: typing.Sequence[int],
+                     output_file: typing.BinaryIO) -> None:
+        """Writes words as a binary image.
+
+        Args:
+            words (typing.Sequence[int]): 16-bit machine words.
+            output_file (typing.BinaryIO): the output file.
+        """
+        HackImage.write_binary_header(len(words), output_file)
+        HackImage.write_binary_words(words, output_file)
+
+    @staticmethod
+    def write_binary_header(word_count: int,
+                            output_file: typing.BinaryIO) -> None:
+        """Writes the header of a binary image. Writers that stream their
+        words must know how many there are in advance.
+
+        Args:
+            word_count (int): the number of words in the image.
+            output_file (typing.BinaryIO): the output file.
+        """
+        output_file.write(HackImage.HEADER.pack(
+            HackImage.MAGIC, HackImage.VERSION, 0, word_count))
+
+    @staticmethod
+    def write_binary_words(words: typing.Sequence[int],
+                           output_file: typing.BinaryIO) -> None:
+        """Writes words of a binary image, after its header.
+
+        Args:
+            words (typing.Sequence[int]): 16-bit machine words.
+            output_file (typing.BinaryIO): the output file.
+        """
+        if not isinstance(words, array.array) or words.typecode != 'H':
+            words = array.array('H', words)
+        if sys.byteorder != "little":
+            words = array.array('H', words)
+            words.byteswap()
+        output_file.write(memoryview(words).cast('B'))
+
+    @staticmethod
+    def read_binary(data: typing.Union[bytes, bytearray, memoryview, mmap.mmap]
+                    ) -> memoryview:
+        """Views the words of a binary image without copying them.
+
+        Args:
+            data: the whole binary image.
+
+        Returns:
+            memoryview: a view of the words, with format 'H'. On big-endian
+            machines the words have to be byte-swapped, so they are copied.
+        """
+        magic, version, flags, count = HackImage.HEADER.unpack_from(data)
+        if magic != HackImage.MAGIC:
+            raise ValueError("not a binary .hack image")
+        if version != HackImage.VERSION:
+            raise ValueError(f"unsupported binary .hack version {version}")
+        start = HackImage.HEADER.size
+        end = start + 2 * count
+        if len(data) < end:
+            raise ValueError("truncated binary .hack image")
+        view = memoryview(data)[start:end]
+        if sys.byteorder != "little":
+            words = array.array('H', view.tobytes())
+            words.byteswap()
+            return memoryview(words)
+        return view.cast('H')
+
+    @staticmethod
+    def load_binary(path: str) -> memoryview:
+        """Memory-maps a binary image and views its words in place.
+
+        The mapping stays alive for as long as the returned view (or any view
+        derived from it) does; call release() on it to unmap early.
+
+        Args:
+            path (str): path of the binary image.
+
+        Returns:
+            memoryview: the words of the image, with format 'H'.
+        """
+        with open(path, 'rb') as image_file:
+            if image_file.seek(0, 2) == 0:
+                raise ValueError("not a binary .hack image")
+            mapping = mmap.mmap(image_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        return HackImage.read_binary(mapping)
+
+    @staticmethod
+    def write_text(words: typing.Sequence[int],
+                   output_file: typing.TextIO) -> None:
+        """Writes words in the text format.
+
+        Args:
+            words (typing.Sequence[int]): 16-bit machine words.
+            output_file (typing.TextIO): the output file.
+        """
+        Code.write_words(words, output_file)
+
+    @staticmethod
+    def read_text(input_file: typing.TextIO) -> array.array:
+        """Reads words from the text format.
+
+        Args:
+            input_file (typing.TextIO): the input file.
+
+        Returns:
+            array.array: the words, with typecode 'H'.
+        """
+        return array.array('H', [int(line, 2) for line in
+                                 input_file.read().split()])
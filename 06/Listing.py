@@ -0,0 +1,109 @@
+"""
+Listing (.lst) output, for the assembler of project 6.
+"""
+import typing
+from Parser import Instruction, L_COMMAND
+from SymbolTable import SymbolTable
+from Code import Code
+
+
+class Listing:
+    """Writes the .lst listing of an assembled program: every instruction
+    with its ROM address, source line and machine word, followed by the
+    label map, the variable map, the ROM size of every label region, and
+    warnings about ROM and RAM overflows.
+    """
+
+    # the ROM has 32K words, and A-instructions can only address that many
+    ROM_SIZE = 32768
+    # variables are allocated in RAM[16..255], below the stack
+    VARIABLES_START = SymbolTable.init_free_address
+    VARIABLES_END = 256
+
+    @staticmethod
+    def warnings(rom_size: int, symbol_table: SymbolTable
+                 ) -> typing.List[str]:
+        """
+        Args:
+            rom_size (int): the number of instructions in the program.
+            symbol_table (SymbolTable): the symbol table of the program.
+
+        Returns:
+            typing.List[str]: a warning for every overflow of the program.
+        """
+        warnings = []
+        if rom_size > Listing.ROM_SIZE:
+            warnings.append(f"the program has {rom_size} instructions, "
+                            f"{rom_size - Listing.ROM_SIZE} more than the "
+                            f"ROM holds")
+        far_labels = [label for label, address in
+                      symbol_table.labels().items()
+                      if address >= Listing.ROM_SIZE]
+        if far_labels:
+            warnings.append(f"{len(far_labels)} label(s) are past the "
+                            f"addressable ROM, starting with "
+                            f"{far_labels[0]}")
+        variables = symbol_table.variables()
+        if variables and max(variables.values()) >= Listing.VARIABLES_END:
+            warnings.append(f"{len(variables)} variables overflow "
+                            f"RAM[{Listing.VARIABLES_START}.."
+                            f"{Listing.VARIABLES_END - 1}] into the stack")
+        return warnings
+
+    @staticmethod
+    def write(instructions: typing.Iterable[Instruction],
+              words: typing.Sequence[int],
+              symbol_table: SymbolTable,
+              output_file: typing.TextIO) -> None:
+        """Writes the listing.
+
+        Args:
+            instructions (typing.Iterable[Instruction]): the assembled
+                commands, including labels.
+            words (typing.Sequence[int]): the machine words of the commands.
+            symbol_table (SymbolTable): the symbol table after assembly.
+            output_file (typing.TextIO): the .lst file.
+        """
+        write = output_file.write
+
+        write("// ROM   LINE  WORD              SOURCE\n")
+        regions = [["", 0]]
+        rom_address = 0
+        for instruction in instructions:
+            if instruction.command_type == L_COMMAND:
+                write(f"//            {instruction.line:>5}"
+                      f"                    {instruction}\n")
+                regions.append([instruction.symbol, 0])
+                continue
+            write(f"{rom_address:>7} {instruction.line:>5}  "
+                  f"{Code.word_text(words[rom_address])}  {instruction}\n")
+            regions[-1][1] += 1
+            rom_address += 1
+
+        labels = symbol_table.labels()
+        write(f"\n// labels ({len(labels)})\n")
+        for label, address in labels.items():
+            write(f"{address:>7}  {label}\n")
+
+        variables = symbol_table.variables()
+        write(f"\n// variables ({len(variables)})\n")
+        for variable, address in variables.items():
+            write(f"{address:>7}  {variable}\n")
+        used = sum(1 for address in variables.values()
+                   if Listing.VARIABLES_START <= address
+                   < Listing.VARIABLES_END)
+        available = Listing.VARIABLES_END - Listing.VARIABLES_START
+        write(f"// RAM[{Listing.VARIABLES_START}.."
+              f"{Listing.VARIABLES_END - 1}]: {used} of {available} words "
+              f"used ({100 * used / available:.1f}%)\n")
+
+        write("\n// instructions per label region\n")
+        if regions[0][1] == 0:
+            del regions[0]
+        for label, count in regions:
+            write(f"{count:>7}  {label or '(start)'}\n")
+
+        write(f"\n// ROM: {rom_address} of {Listing.ROM_SIZE} words used "
+              f"({100 * rom_address / Listing.ROM_SIZE:.1f}%)\n")
+        for warning in Listing.warnings(rom_address, symbol_table):
+            write(f"// WARNING: {warning}\n")
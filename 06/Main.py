@@ -5,76 +5,510 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import array
+import concurrent.futures
+import contextlib
+import itertools
 import os
 import sys
+import time
 import typing
 from SymbolTable import SymbolTable
-from Parser import Parser
+from Parser import Parser, Instruction
 from Code import Code
-import plotly.graph_objs as go
+from HackImage import HackImage
+from BuildCache import BuildCache
+from Optimizer import Optimizer
+from Listing import Listing
+from AssemblyIndex import AssemblyIndex
+from SourceMap import SourceMap
 ##### constants #####
 
 # address constants
 FREE_ADDRESS_INDICATION = -1
 
+# output file extensions
+TEXT_EXTENSION = ".hack"
+BINARY_EXTENSION = ".hackb"
+LISTING_EXTENSION = ".lst"
+SOURCE_MAP_EXTENSION = ".hmap"
+
+# assemble_file options that change the output, and so the cache key
+OUTPUT_OPTIONS = ("binary_mode", "optimize_mode")
+
 # command types constants
 A_COMMAND = 'A_COMMAND'
 C_COMMAND = 'C_COMMAND'
 L_COMMAND = 'L_COMMAND'
 
-# string constants
-NEW_LINE = '\n'
-
-def assemble_file(input_file: typing.TextIO, output_file: typing.TextIO) -> None:
-    """Assembles a single file.
+def assemble_file(input_file: typing.TextIO,
+                  output_file: typing.Union[typing.TextIO, typing.BinaryIO],
+                  single_pass_mode: bool = False,
+                  binary_mode: bool = False,
+                  streaming_mode: bool = False,
+                  optimize_mode: bool = False,
+                  listing_file: typing.Optional[typing.TextIO] = None,
+                  source_map_file: typing.Optional[typing.BinaryIO] = None
+                  ) -> None:
+    """Assembles a single file. Overflows of the ROM or of the variables
+    region are reported to stderr.
 
     Args:
         input_file (typing.TextIO): the file to assemble.
-        output_file (typing.TextIO): writes all output to this file.
+        output_file (typing.Union[typing.TextIO, typing.BinaryIO]): writes all
+            output to this file. Must be opened in binary mode if binary_mode
+            is True.
+        single_pass_mode (bool): if this is True, the file is assembled in a
+            single pass, and forward label references are backpatched.
+        binary_mode (bool): if this is True, the output is a binary image
+            (see HackImage) instead of the text .hack format.
+        streaming_mode (bool): if this is True, the input is read twice
+            instead of being held in memory (see assemble_stream). Ignored
+            if the input is not seekable, or if optimize_mode is True.
+        optimize_mode (bool): if this is True, the peephole optimizer (see
+            Optimizer) rewrites the program before it is encoded.
+        listing_file (typing.Optional[typing.TextIO]): if given, a listing
+            of the program (see Listing) is written to it. Streaming is not
+            possible then.
+        source_map_file (typing.Optional[typing.BinaryIO]): if given, a
+            source map of the program (see SourceMap) is written to it.
+            Streaming is not possible then either.
+    """
+    if streaming_mode and not optimize_mode and listing_file is None and \
+            source_map_file is None and input_file.seekable():
+        assemble_stream(input_file, output_file, binary_mode)
+        return
+
+    # the source map needs the comments, which the parser drops
+    source = input_file.readlines() if source_map_file is not None \
+        else input_file
+    parser = Parser(source)
+    if optimize_mode:
+        parser.set_instructions(Optimizer.optimize(parser.instructions()))
+    code = Code()
+    symbol_table = SymbolTable()
+
+    if single_pass_mode:
+        words = single_pass(parser, code, symbol_table)
+    else:
+        first_pass(parser, symbol_table)
+
+        parser.reset_parser()
+
+        words = second_pass(parser, code, symbol_table)
+
+    # the words are rendered only once the whole program is encoded
+    if binary_mode:
+        HackImage.write_binary(words, output_file)
+    else:
+        HackImage.write_text(words, output_file)
+
+    if listing_file is not None:
+        Listing.write(parser.instructions(), words, symbol_table,
+                      listing_file)
+    if source_map_file is not None:
+        SourceMap.build(source, parser.instructions()).write(source_map_file)
+    report_overflows(input_file, len(words), symbol_table)
+
+
+def assemble(source: typing.Union[str, bytes, typing.Iterable[str]],
+             symbols: typing.Optional[typing.Dict[str, int]] = None,
+             source_map: typing.Optional[typing.List[int]] = None,
+             single_pass_mode: bool = False,
+             optimize_mode: bool = False) -> array.array:
+    """Assembles a program in memory, without any file I/O. Every call uses
+    its own symbol table, so it is safe to call repeatedly.
+
+    Args:
+        source (typing.Union[str, bytes, typing.Iterable[str]]): the source
+            of the program, or an iterable of its lines.
+        symbols (typing.Optional[typing.Dict[str, int]]): if given, the
+            labels and variables of the program and their addresses are
+            added to it.
+        source_map (typing.Optional[typing.List[int]]): if given, the
+            1-based source line of every instruction is appended to it, in
+            ROM order.
+        single_pass_mode (bool): see assemble_file.
+        optimize_mode (bool): see assemble_file.
+
+    Returns:
+        array.array: the machine words of the program, with typecode 'H'.
     """
-    parser = Parser(input_file)
+    if isinstance(source, bytes):
+        source = source.decode()
+    if isinstance(source, str):
+        source = source.splitlines()
+    parser = Parser(source)
+    if optimize_mode:
+        parser.set_instructions(Optimizer.optimize(parser.instructions()))
     code = Code()
     symbol_table = SymbolTable()
+    if single_pass_mode:
+        words = single_pass(parser, code, symbol_table)
+    else:
+        first_pass(parser, symbol_table)
+        words = second_pass(parser, code, symbol_table)
+    if symbols is not None:
+        symbols.update(symbol_table.labels())
+        symbols.update(symbol_table.variables())
+    if source_map is not None:
+        source_map.extend(instruction.line for instruction
+                          in parser.instructions()
+                          if instruction.command_type != L_COMMAND)
+    return words
+
 
-    first_pass(parser, symbol_table)
+def report_overflows(input_file: typing.TextIO, rom_size: int,
+                     symbol_table: SymbolTable) -> None:
+    """Prints a warning to stderr for every overflow of the program.
 
-    parser.reset_parser()
+    Args:
+        input_file (typing.TextIO): the assembled file.
+        rom_size (int): the number of instructions in the program.
+        symbol_table (SymbolTable): the symbol table after assembly.
+    """
+    name = getattr(input_file, "name", "<input>")
+    for warning in Listing.warnings(rom_size, symbol_table):
+        print(f"{name}: warning: {warning}", file=sys.stderr)
 
-    second_pass(parser, code, symbol_table, output_file)
+
+def assemble_stream(input_file: typing.TextIO,
+                    output_file: typing.Union[typing.TextIO, typing.BinaryIO],
+                    binary_mode: bool = False) -> None:
+    """Assembles a single file with bounded memory, no matter how large it
+    is. The first pass reads the input incrementally and keeps only the
+    symbol table. The second pass seeks back and re-reads the input, and
+    streams the encoded words to the output in blocks.
+
+    Args:
+        input_file (typing.TextIO): the file to assemble. Must be seekable.
+        output_file (typing.Union[typing.TextIO, typing.BinaryIO]): writes all
+            output to this file. Must be opened in binary mode if binary_mode
+            is True.
+        binary_mode (bool): if this is True, the output is a binary image
+            (see HackImage) instead of the text .hack format.
+    """
+    code = Code()
+    symbol_table = SymbolTable()
+    start = input_file.tell()
+
+    word_count = 0
+    for instruction in Parser.lex(input_file):
+        if instruction.command_type == L_COMMAND:
+            symbol_table.add_entry(instruction.symbol, word_count)
+        else:
+            word_count += 1
+
+    input_file.seek(start)
+
+    if binary_mode:
+        HackImage.write_binary_header(word_count, output_file)
+        write_words = HackImage.write_binary_words
+    else:
+        write_words = HackImage.write_text
+    words = array.array('H')
+    for instruction in Parser.lex(input_file):
+        command_type = instruction.command_type
+        if command_type == A_COMMAND:
+            words.append(code.encode_A(instruction.symbol, symbol_table))
+        elif command_type == C_COMMAND:
+            words.append(code.encode_C(instruction.dest, instruction.comp,
+                                       instruction.jump))
+        else:
+            continue
+        if len(words) == Code.WRITE_CHUNK_SIZE:
+            write_words(words, output_file)
+            del words[:]
+    write_words(words, output_file)
+    report_overflows(input_file, word_count, symbol_table)
 
 
 def first_pass(parser: Parser, symbol_table: SymbolTable) -> None:
     line_counter = 0
-    while parser.has_more_commands():
-        parser.advance()
-        command_type = parser.command_type()
+    for instruction in parser.instructions():
+        command_type = instruction.command_type
         if command_type==A_COMMAND or command_type==C_COMMAND:
             line_counter += 1
         elif command_type==L_COMMAND:
-            symbol = parser.symbol()
-            symbol_table.add_entry(symbol, line_counter)
+            symbol_table.add_entry(instruction.symbol, line_counter)
         
 
 def second_pass(parser: Parser,
                  code: Code,
-                   symbol_table: SymbolTable,
-                     output_file: typing.TextIO) -> None:
-    while parser.has_more_commands():
-        parser.advance()
-        command_type = parser.command_type()
+                   symbol_table: SymbolTable) -> array.array:
+    words = array.array('H')
+    for instruction in parser.instructions():
+        command_type = instruction.command_type
         if command_type == A_COMMAND:
-            symbol = parser.symbol()
-            if not symbol.isdigit() and not symbol_table.contains(symbol):
-                symbol_table.add_entry(symbol, FREE_ADDRESS_INDICATION)
-            output_file.write(code.A_command(symbol, symbol_table) + NEW_LINE)
+            words.append(code.encode_A(instruction.symbol, symbol_table))
         elif command_type==C_COMMAND:
-            dest = parser.dest()
-            comp = parser.comp()
-            jump = parser.jump()
-            if "<<" in comp or ">>" in comp:
-                output_file.write(code.shift_commad(dest, comp, jump) + NEW_LINE)
+            words.append(code.encode_C(instruction.dest, instruction.comp,
+                                       instruction.jump))
+    return words
+
+
+def single_pass(parser: Parser,
+                code: Code,
+                symbol_table: SymbolTable) -> array.array:
+    """Assembles the whole input in one pass over the parser.
+
+    Instructions are emitted into a preallocated buffer, and the ROM
+    addresses of the A-instructions that reference labels are recorded per
+    label. References to a symbol that is not in the table yet are left
+    empty, and they are backpatched when the (LABEL) of the symbol is seen.
+    Since a later (LABEL) overrides an earlier one, a redefinition patches
+    all the recorded references again. Symbols that are still unresolved at
+    the end of the input are variables, and they are allocated in order of
+    first appearance, exactly like the two-pass assembler does.
+
+    Args:
+        parser (Parser): a parser positioned at the beginning of the input.
+        code (Code): the code translator.
+        symbol_table (SymbolTable): the symbol table.
+
+    Returns:
+        array.array: the machine words of the program, in ROM order.
+    """
+    instructions = parser.instructions()
+    words = array.array('H', bytes(2 * len(instructions)))
+    # label or unresolved symbol -> ROM addresses of its references
+    references = {}
+    rom_address = 0
+    for instruction in instructions:
+        command_type = instruction.command_type
+        if command_type == A_COMMAND:
+            symbol = instruction.symbol
+            if symbol.isdigit():
+                words[rom_address] = code.encode_A(symbol, symbol_table)
             else:
-                output_file.write(code.C_command(dest, comp, jump) + NEW_LINE)
+                symbol_references = references.get(symbol)
+                address = symbol_table.lookup(symbol)
+                if address is not None:
+                    words[rom_address] = address & 0x7FFF
+                    if symbol_references is not None:
+                        symbol_references.append(rom_address)
+                elif symbol_references is None:
+                    references[symbol] = [rom_address]
+                else:
+                    symbol_references.append(rom_address)
+            rom_address += 1
+        elif command_type == C_COMMAND:
+            words[rom_address] = code.encode_C(instruction.dest,
+                                               instruction.comp,
+                                               instruction.jump)
+            rom_address += 1
+        elif command_type == L_COMMAND:
+            symbol = instruction.symbol
+            symbol_references = references.get(symbol)
+            if symbol_references is None:
+                # a label that overrides a predefined symbol also applies to
+                # the references that were already resolved
+                symbol_references = find_references(instructions, symbol) \
+                    if symbol_table.contains(symbol) else []
+                references[symbol] = symbol_references
+            symbol_table.add_entry(symbol, rom_address)
+            backpatch(words, symbol_references, symbol, code, symbol_table)
+
+    # whatever is still unresolved was never declared as a label
+    for symbol, symbol_references in references.items():
+        if not symbol_table.contains(symbol):
+            symbol_table.add_entry(symbol, FREE_ADDRESS_INDICATION)
+            backpatch(words, symbol_references, symbol, code, symbol_table)
+
+    del words[rom_address:]
+    return words
+
+
+def find_references(instructions: typing.Iterable[Instruction],
+                    symbol: str) -> typing.List[int]:
+    """
+    Args:
+        instructions (typing.Iterable[Instruction]): tokenized commands.
+        symbol (str): a symbol.
+
+    Returns:
+        typing.List[int]: the ROM addresses of all the A-instructions that
+        reference the symbol.
+    """
+    references = []
+    rom_address = 0
+    for instruction in instructions:
+        if instruction.command_type == A_COMMAND:
+            if instruction.symbol == symbol:
+                references.append(rom_address)
+            rom_address += 1
+        elif instruction.command_type == C_COMMAND:
+            rom_address += 1
+    return references
+
+
+def backpatch(words: array.array,
+              references: typing.Iterable[int],
+              symbol: str,
+              code: Code,
+              symbol_table: SymbolTable) -> None:
+    """Fills in the A-instructions that referenced a symbol before it was
+    resolved.
+
+    Args:
+        words (array.array): the instruction buffer.
+        references (typing.Iterable[int]): ROM addresses to patch.
+        symbol (str): the now resolved symbol.
+        code (Code): the code translator.
+        symbol_table (SymbolTable): the symbol table.
+    """
+    if not references:
+        return
+    word = code.encode_A(symbol, symbol_table)
+    for rom_address in references:
+        words[rom_address] = word
+
+
+def assemble_incremental(input_path: str, output_path: str,
+                         binary_mode: bool = False) -> AssemblyIndex:
+    """Assembles a single file, re-encoding only the lines that changed
+    since it was last assembled this way (see AssemblyIndex). The sidecar
+    index of the file is updated afterwards.
+
+    Args:
+        input_path (str): path of the .asm file.
+        output_path (str): path of the output file.
+        binary_mode (bool): if this is True, the output is a binary image
+            (see HackImage) instead of the text .hack format.
+
+    Returns:
+        AssemblyIndex: the new index of the file.
+    """
+    index_path = AssemblyIndex.path_for(input_path)
+    with open(input_path, 'rb') as input_file:
+        lines = input_file.read().splitlines()
+    index, symbol_table = AssemblyIndex.build(lines,
+                                              AssemblyIndex.load(index_path))
+    with open(output_path, 'wb' if binary_mode else 'w') as output_file:
+        if binary_mode:
+            HackImage.write_binary(index.words, output_file)
+        else:
+            HackImage.write_text(index.words, output_file)
+    index.save(index_path)
+    for warning in Listing.warnings(len(index.words), symbol_table):
+        print(f"{input_path}: warning: {warning}", file=sys.stderr)
+    return index
+
+
+def assemble_path(input_path: str, options: typing.Dict[str, bool],
+                  cache: typing.Optional[BuildCache] = None,
+                  listing: bool = False, source_map: bool = False
+                  ) -> typing.Tuple[str, str, float, bool]:
+    """Assembles a single .asm file into a .hack file next to it. This is
+    the unit of work of the parallel driver, so it only takes picklable
+    arguments.
+
+    Args:
+        input_path (str): path of the .asm file.
+        options (typing.Dict[str, bool]): keyword arguments for
+            assemble_file, and "incremental_mode" to assemble with
+            assemble_incremental instead (unless optimize_mode is set, or a
+            listing is requested).
+        cache (typing.Optional[BuildCache]): if given, an output that is
+            already in the cache is copied from it instead of assembled.
+        listing (bool): if this is True, a .lst listing is written next to
+            the output too. The cache is bypassed then.
+        source_map (bool): if this is True, a .hmap source map is written
+            next to the output too. The cache is bypassed then as well.
+
+    Returns:
+        typing.Tuple[str, str, float, bool]: the input path, the output
+        path, the time it took to assemble the file in seconds, and whether
+        the output came from the cache.
+    """
+    start = time.perf_counter()
+    options = dict(options)
+    incremental_mode = options.pop("incremental_mode", False)
+    binary_mode = options.get("binary_mode", False)
+    output_path = os.path.splitext(input_path)[0] + (
+        BINARY_EXTENSION if binary_mode else TEXT_EXTENSION)
+    if listing or source_map:
+        cache = None
+    elif incremental_mode and not options.get("optimize_mode", False):
+        assemble_incremental(input_path, output_path, binary_mode)
+        return input_path, output_path, time.perf_counter() - start, False
+    if cache is not None:
+        key_options = [(option, options.get(option, False))
+                       for option in OUTPUT_OPTIONS]
+        if options.get("optimize_mode", False):
+            key_options.append(("optimizer_version", Optimizer.VERSION))
+        key = cache.key(input_path, repr(key_options))
+        if cache.fetch(key, output_path):
+            return input_path, output_path, time.perf_counter() - start, True
+    base_path = os.path.splitext(input_path)[0]
+    with open(input_path, 'r') as input_file, \
+            open(output_path, 'wb' if binary_mode else 'w') as output_file, \
+            contextlib.ExitStack() as extra_files:
+        if listing:
+            options["listing_file"] = extra_files.enter_context(
+                open(base_path + LISTING_EXTENSION, 'w'))
+        if source_map:
+            options["source_map_file"] = extra_files.enter_context(
+                open(base_path + SOURCE_MAP_EXTENSION, 'wb'))
+        assemble_file(input_file, output_file, **options)
+    if cache is not None:
+        cache.store(key, output_path)
+    return input_path, output_path, time.perf_counter() - start, False
+
+
+def find_asm_files(path: str) -> typing.List[str]:
+    """
+    Args:
+        path (str): a .asm file, or a directory.
+
+    Returns:
+        typing.List[str]: the path itself, or all the .asm files in the
+        directory tree under it, in a deterministic (sorted) order.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    files_to_assemble = []
+    for directory, subdirectories, filenames in os.walk(path):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() == ".asm":
+                files_to_assemble.append(os.path.join(directory, filename))
+    return files_to_assemble
+
+
+def assemble_paths(paths: typing.List[str], options: typing.Dict[str, bool],
+                   jobs: typing.Optional[int] = None,
+                   cache: typing.Optional[BuildCache] = None,
+                   listing: bool = False, source_map: bool = False
+                   ) -> typing.Iterator[typing.Tuple[str, str, float, bool]]:
+    """Assembles many files concurrently, each in its own worker process.
+
+    Args:
+        paths (typing.List[str]): paths of .asm files.
+        options (typing.Dict[str, bool]): keyword arguments for
+            assemble_file.
+        jobs (typing.Optional[int]): number of worker processes. Defaults to
+            the number of CPUs.
+        cache (typing.Optional[BuildCache]): an optional build cache.
+        listing (bool): whether to write .lst listings too.
+        source_map (bool): whether to write .hmap source maps too.
+
+    Yields:
+        typing.Tuple[str, str, float, bool]: the results of assemble_path, in
+        the order of the given paths.
+    """
+    if len(paths) <= 1 or jobs == 1:
+        for input_path in paths:
+            yield assemble_path(input_path, options, cache, listing,
+                                source_map)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(assemble_path, paths,
+                                itertools.repeat(options),
+                                itertools.repeat(cache),
+                                itertools.repeat(listing),
+                                itertools.repeat(source_map))
 
 
 if "__main__" == __name__:
@@ -83,16 +517,72 @@ if "__main__" == __name__:
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    x = [3, 1.5, 0.75, 0.375, 0.1875, 0.09375, 0.046875, 0.023438, 0.011719, 0.0058594, 0.0029297, 0.001465]
-    y = [2.167, 2.241, 2.078, 1.896, 1.694, 0.65, 0.465, 0.267, 0.1225, 0.051, 0.0205, 0.0335]
-
-    # Create scatter plot
-    plt.scatter(x, y)
-
-    # Add labels and title
-    plt.xlabel('X-axis')
-    plt.ylabel('Y-axis')
-    plt.title('Scatter Plot')
+    # Files of a directory are assembled concurrently, and reported in a
+    # deterministic order.
+    argument_parser = argparse.ArgumentParser(
+        prog="Assembler", description="Assembles Hack .asm files.")
+    argument_parser.add_argument(
+        "path", help="a .asm file, or a directory of .asm files")
+    argument_parser.add_argument(
+        "--single-pass", action="store_true",
+        help="assemble in one pass, backpatching forward references")
+    argument_parser.add_argument(
+        "--binary", action="store_true",
+        help=f"write binary {BINARY_EXTENSION} images instead of text")
+    argument_parser.add_argument(
+        "--streaming", action="store_true",
+        help="read the input twice instead of holding it in memory")
+    argument_parser.add_argument(
+        "--optimize", action="store_true",
+        help="run the peephole optimizer before encoding")
+    argument_parser.add_argument(
+        "--incremental", action="store_true",
+        help="re-encode only the lines that changed since the last "
+             f"incremental run, using {AssemblyIndex.EXTENSION} sidecar files")
+    argument_parser.add_argument(
+        "--listing", action="store_true",
+        help=f"also write a {LISTING_EXTENSION} listing of every program")
+    argument_parser.add_argument(
+        "--source-map", action="store_true",
+        help=f"also write a {SOURCE_MAP_EXTENSION} source map of every "
+             "program")
+    argument_parser.add_argument(
+        "--jobs", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    argument_parser.add_argument(
+        "--cache", nargs="?", const=BuildCache.DEFAULT_DIRECTORY,
+        default=None, metavar="DIRECTORY",
+        help="reuse outputs of identical inputs from a build cache "
+             f"(default directory: {BuildCache.DEFAULT_DIRECTORY})")
+    argument_parser.add_argument(
+        "--cache-size", type=int, default=BuildCache.DEFAULT_MAX_BYTES,
+        metavar="BYTES", help="size limit of the build cache")
+    arguments = argument_parser.parse_args()
+    # streaming reads the input twice, and keeps nothing for the other modes
+    if arguments.streaming:
+        for flag in ("single_pass", "optimize", "incremental", "listing",
+                     "source_map"):
+            if getattr(arguments, flag):
+                argument_parser.error(
+                    f"--streaming cannot be combined with "
+                    f"--{flag.replace('_', '-')}")
 
-    # Show plot
-    plt.show()
+    argument_path = os.path.abspath(arguments.path)
+    options = {"single_pass_mode": arguments.single_pass,
+               "binary_mode": arguments.binary,
+               "streaming_mode": arguments.streaming,
+               "optimize_mode": arguments.optimize,
+               "incremental_mode": arguments.incremental}
+    cache = None
+    if arguments.cache is not None:
+        cache = BuildCache(arguments.cache, arguments.cache_size)
+    total_start = time.perf_counter()
+    paths = find_asm_files(argument_path)
+    for input_path, output_path, seconds, cached in assemble_paths(
+            paths, options, arguments.jobs, cache, arguments.listing,
+            arguments.source_map):
+        print(f"{os.path.relpath(input_path)} -> "
+              f"{os.path.relpath(output_path)}: {seconds:.4f}s"
+              f"{' (cached)' if cached else ''}")
+    print(f"assembled {len(paths)} file(s) in "
+          f"{time.perf_counter() - total_start:.4f}s")
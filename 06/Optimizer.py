@@ -0,0 +1,254 @@
+"""
+A peephole optimizer for Hack assembly, for the assembler of project 6.
+"""
+import typing
+from Parser import Instruction, A_COMMAND, C_COMMAND, L_COMMAND
+
+
+class Optimizer:
+    """A peephole optimizer over tokenized Hack assembly, run between the
+    Parser and the Code translator. It rewrites the instruction list
+    symbolically, so labels have to be (and are) resolved only afterwards.
+
+    The rewrites move code, so they assume that control only reaches a label
+    through its symbol. This holds for code emitted by the VM translator, but
+    not for hand-written code that jumps to numeric ROM addresses, which is
+    left as it is (see jumps_to_addresses).
+    """
+
+    # identifies the rewrites, so that outputs of different versions of the
+    # optimizer are never mixed up
+    VERSION = 3
+
+    # the values of the constant computations
+    __constants = {"0": 0, "1": 1, "-1": -1}
+
+    # jump mnemonic -> the condition, as a function of the computed value
+    __conditions = {"JGT": lambda value: value > 0,
+                    "JEQ": lambda value: value == 0,
+                    "JGE": lambda value: value >= 0,
+                    "JLT": lambda value: value < 0,
+                    "JNE": lambda value: value != 0,
+                    "JLE": lambda value: value <= 0,
+                    "JMP": lambda value: True}
+
+    # pushes D onto the stack, and pops it right back
+    __PUSH_POP = ("@SP", "M=M+1", "A=M-1", "M=D", "@SP", "M=M-1", "A=M", "D=M")
+
+    @staticmethod
+    def optimize(instructions: typing.List[Instruction]
+                 ) -> typing.List[Instruction]:
+        """Runs all the rewrites until none of them applies anymore.
+
+        Args:
+            instructions (typing.List[Instruction]): tokenized commands.
+
+        Returns:
+            typing.List[Instruction]: the optimized commands, or the given
+            ones if they jump to numeric addresses.
+        """
+        if Optimizer.jumps_to_addresses(instructions):
+            return instructions
+        while True:
+            size = len(instructions)
+            instructions = Optimizer.fold_increments(instructions)
+            instructions = Optimizer.remove_redundant_loads(instructions)
+            instructions = Optimizer.remove_unreachable(instructions)
+            threaded = Optimizer.thread_jumps(instructions)
+            if not threaded and len(instructions) == size:
+                return instructions
+
+    @staticmethod
+    def jumps_to_addresses(instructions: typing.List[Instruction]) -> bool:
+        """
+        Args:
+            instructions (typing.List[Instruction]): tokenized commands.
+
+        Returns:
+            bool: True if a numeric A-command feeds a jump, like "@133, 0;JMP".
+            Such a jump breaks once any command before its target is removed.
+        """
+        return any(instruction.command_type == A_COMMAND and
+                   instruction.symbol.isdigit() and
+                   jump.command_type == C_COMMAND and jump.jump != 'null'
+                   for instruction, jump in zip(instructions,
+                                                instructions[1:]))
+
+    @staticmethod
+    def is_unconditional_jump(instruction: Instruction) -> bool:
+        """
+        Args:
+            instruction (Instruction): a tokenized command.
+
+        Returns:
+            bool: True if the command is a C-command that always jumps, like
+            "0;JMP" or "0;JEQ".
+        """
+        if instruction.command_type != C_COMMAND or \
+                instruction.jump == 'null':
+            return False
+        if instruction.jump == "JMP":
+            return True
+        value = Optimizer.__constants.get(instruction.comp)
+        return value is not None and \
+            Optimizer.__conditions[instruction.jump](value)
+
+    @staticmethod
+    def fold_increments(instructions: typing.List[Instruction]
+                        ) -> typing.List[Instruction]:
+        """Folds stack pointer increments that are immediately undone:
+
+        - "@X, M=M+1, @X, M=M-1" (or the opposite order) becomes "@X",
+          which leaves both the memory and the A register as they were.
+        - a push of D that is immediately popped back into D,
+          "@SP, M=M+1, A=M-1, M=D, @SP, M=M-1, A=M, D=M", becomes
+          "@SP, A=M, M=D", which leaves the memory and all the registers
+          exactly as the longer sequence does.
+        """
+        push_pop = Optimizer.__PUSH_POP
+        optimized = []
+        index = 0
+        count = len(instructions)
+        while index < count:
+            instruction = instructions[index]
+            if instruction.command_type == A_COMMAND and index + 3 < count:
+                window = instructions[index:index + len(push_pop)]
+                if len(window) == len(push_pop) and \
+                        all(str(window_instruction) == text for
+                            window_instruction, text in zip(window, push_pop)):
+                    optimized.extend((window[0], window[6], window[3]))
+                    index += len(push_pop)
+                    continue
+                first, second, third = instructions[index + 1:index + 4]
+                if third.command_type == C_COMMAND and \
+                        first.command_type == C_COMMAND and \
+                        second.command_type == A_COMMAND and \
+                        second.symbol == instruction.symbol and \
+                        first.dest == third.dest == "M" and \
+                        first.jump == third.jump == 'null' and \
+                        {first.comp, third.comp} == {"M+1", "M-1"}:
+                    optimized.append(instruction)
+                    index += 4
+                    continue
+            optimized.append(instruction)
+            index += 1
+        return optimized
+
+    @staticmethod
+    def remove_redundant_loads(instructions: typing.List[Instruction]
+                               ) -> typing.List[Instruction]:
+        """Removes "@X" when the A register already holds X. What A holds is
+        forgotten at every label, since it can be reached from elsewhere.
+        """
+        optimized = []
+        a_symbol = None
+        for instruction in instructions:
+            command_type = instruction.command_type
+            if command_type == A_COMMAND:
+                if instruction.symbol == a_symbol:
+                    continue
+                a_symbol = instruction.symbol
+            elif command_type == L_COMMAND:
+                a_symbol = None
+            elif "A" in instruction.dest:
+                a_symbol = None
+            optimized.append(instruction)
+        return optimized
+
+    @staticmethod
+    def remove_unreachable(instructions: typing.List[Instruction]
+                           ) -> typing.List[Instruction]:
+        """Removes the commands between an unconditional jump and the next
+        label, which nothing can reach.
+        """
+        optimized = []
+        reachable = True
+        for instruction in instructions:
+            if instruction.command_type == L_COMMAND:
+                reachable = True
+            elif not reachable:
+                continue
+            optimized.append(instruction)
+            if Optimizer.is_unconditional_jump(instruction):
+                reachable = False
+        return optimized
+
+    @staticmethod
+    def thread_jumps(instructions: typing.List[Instruction]) -> bool:
+        """Makes jumps to a label whose code is just "@T, 0;JMP" jump to T
+        directly. Only A-commands that feed a jump are rewritten, and only if
+        the jump neither reads nor writes A or M, and A is loaded again right
+        after it (or it always jumps). Otherwise the jump could store the
+        label, or jump to what it wrote to A, or fall through with A still
+        holding the label.
+
+        Args:
+            instructions (typing.List[Instruction]): tokenized commands,
+                rewritten in place.
+
+        Returns:
+            bool: True if any jump was rewritten.
+        """
+        # label -> the target of the trampoline that follows it
+        trampolines = {}
+        pending_labels = []
+        for index, instruction in enumerate(instructions):
+            if instruction.command_type == L_COMMAND:
+                pending_labels.append(instruction.symbol)
+                continue
+            if pending_labels and instruction.command_type == A_COMMAND and \
+                    index + 1 < len(instructions):
+                jump = instructions[index + 1]
+                if Optimizer.is_unconditional_jump(jump) and \
+                        jump.dest == 'null' and \
+                        jump.comp in Optimizer.__constants:
+                    for label in pending_labels:
+                        trampolines[label] = instruction.symbol
+            pending_labels = []
+
+        threaded = False
+        for index in range(len(instructions) - 1):
+            instruction = instructions[index]
+            if instruction.command_type != A_COMMAND or \
+                    instruction.symbol not in trampolines:
+                continue
+            jump = instructions[index + 1]
+            if jump.command_type != C_COMMAND or jump.jump == 'null' or \
+                    "A" in jump.comp or "M" in jump.comp or \
+                    "A" in jump.dest or "M" in jump.dest:
+                continue
+            if not Optimizer.is_unconditional_jump(jump) and \
+                    not Optimizer.__loads_a(instructions, index + 2):
+                continue
+            target = Optimizer.__final_target(instruction.symbol, trampolines)
+            if target != instruction.symbol:
+                instructions[index] = Instruction(A_COMMAND, symbol=target,
+                                                  line=instruction.line)
+                threaded = True
+        return threaded
+
+    @staticmethod
+    def __loads_a(instructions: typing.List[Instruction], index: int) -> bool:
+        """Checks whether the first command executed from the given index on
+        is an A-command, which discards what A held before.
+        """
+        while index < len(instructions):
+            command_type = instructions[index].command_type
+            if command_type != L_COMMAND:
+                return command_type == A_COMMAND
+            index += 1
+        return False
+
+    @staticmethod
+    def __final_target(label: str, trampolines: typing.Dict[str, str]) -> str:
+        """Follows a chain of trampolines. A chain that ends in a cycle never
+        leaves it anyway, so its label is left as it is.
+        """
+        seen = {label}
+        target = label
+        while target in trampolines:
+            target = trampolines[target]
+            if target in seen:
+                return label
+            seen.add(target)
+        return target
@@ -7,6 +7,50 @@ Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 import typing
 
+# command types
+A_COMMAND = 'A_COMMAND'
+C_COMMAND = 'C_COMMAND'
+L_COMMAND = 'L_COMMAND'
+
+
+class Instruction:
+    """A single tokenized command of an assembly program. Every line is
+    tokenized exactly once, into one of these compact records.
+    """
+
+    __slots__ = ("command_type", "symbol", "dest", "comp", "jump", "line")
+
+    def __init__(self, command_type: str, symbol: str = '', dest: str = 'null',
+                 comp: str = '', jump: str = 'null', line: int = 0) -> None:
+        """Creates a new record.
+
+        Args:
+            command_type (str): "A_COMMAND", "C_COMMAND" or "L_COMMAND".
+            symbol (str): the symbol or decimal of an A or L command.
+            dest (str): the dest mnemonic of a C command.
+            comp (str): the comp mnemonic of a C command.
+            jump (str): the jump mnemonic of a C command.
+            line (int): the 1-based line number of the command in the source.
+        """
+        self.command_type = command_type
+        self.symbol = symbol
+        self.dest = dest
+        self.comp = comp
+        self.jump = jump
+        self.line = line
+
+    def __str__(self) -> str:
+        if self.command_type == A_COMMAND:
+            return "@" + self.symbol
+        if self.command_type == L_COMMAND:
+            return "(" + self.symbol + ")"
+        text = self.comp
+        if self.dest != 'null':
+            text = self.dest + "=" + text
+        if self.jump != 'null':
+            text += ";" + self.jump
+        return text
+
 
 class Parser:
     """Encapsulates access to the input code. Reads an assembly program
@@ -15,33 +59,67 @@ class Parser:
     and symbols). In addition, removes all white space and comments.
     """
 
-    def __init__(self, input_file: typing.TextIO) -> None:
+    # C command text -> (dest, comp, jump), shared by all parsers
+    __c_fields = {}
+
+    def __init__(self, input_file: typing.Iterable[str]) -> None:
         """Opens the input file and gets ready to parse it.
 
         Args:
-            input_file (typing.TextIO): input file.
+            input_file (typing.Iterable[str]): input file, or any other
+                iterable of source lines.
         """
         self.__current_line = -1
-        self.__current_command = ''
-
-        # Read lines from input file
-        self.__input_lines = input_file.read().splitlines()
-
-        # Remove start and end whitespaces from each line
-        self.__input_lines = [line.strip() for line in self.__input_lines]
-
-        # Remove \n from each line
-        self.__input_lines = [line.replace('\n', '') for line in self.__input_lines]
-
-        # Remove empty lines
-        self.__input_lines = [line for line in self.__input_lines if line]
+        self.__current = None
+        self.__instructions = list(Parser.lex(input_file))
 
-        # Remove lines starting with '/'
-        self.__input_lines = [line for line in self.__input_lines if not(line.startswith('/'))]
+    @staticmethod
+    def lex(input_file: typing.Iterable[str]) -> typing.Iterator[Instruction]:
+        """Tokenizes the input one line at a time, so memory does not grow
+        with the size of the input.
 
-        # Remove comments after valid lines
-        self.__input_lines = [line.split('/')[0] for line in self.__input_lines]
+        Args:
+            input_file (typing.Iterable[str]): input file, or any other
+                iterable of source lines.
 
+        Yields:
+            Instruction: the commands of the input, in order.
+        """
+        c_fields = Parser.__c_fields
+        for line_number, line in enumerate(input_file, 1):
+            line = line.strip()
+            # skip empty lines and whole-line comments
+            if not line or line[0] == '/':
+                continue
+            # remove comments after valid commands, and all the white space
+            comment = line.find('/')
+            if comment != -1:
+                line = line[:comment]
+            command = line.replace(" ", "").replace("\t", "")
+            first = command[0]
+            if first == '@':
+                yield Instruction(A_COMMAND, symbol=command[1:],
+                                  line=line_number)
+            elif first == '(':
+                yield Instruction(L_COMMAND,
+                                  symbol=command.split(')')[0][1:],
+                                  line=line_number)
+            else:
+                fields = c_fields.get(command)
+                if fields is None:
+                    fields = c_fields[command] = Parser.__split_c(command)
+                dest, comp, jump = fields
+                yield Instruction(C_COMMAND, dest=dest, comp=comp, jump=jump,
+                                  line=line_number)
+
+    @staticmethod
+    def __split_c(command: str) -> typing.Tuple[str, str, str]:
+        """Splits a C command into its dest, comp and jump mnemonics."""
+        dest, equals, rest = command.partition('=')
+        if not equals:
+            dest, rest = 'null', command
+        comp, semicolon, jump = rest.partition(';')
+        return dest, comp, jump or 'null'
 
     def has_more_commands(self) -> bool:
         """Are there more commands in the input?
@@ -49,21 +127,52 @@ class Parser:
         Returns:
             bool: True if there are more commands, False otherwise.
         """
-        return self.__current_line < len(self.__input_lines) - 1
+        return self.__current_line < len(self.__instructions) - 1
 
     def advance(self) -> None:
         """Reads the next command from the input and makes it the current command.
         Should be called only if has_more_commands() is true.
         """
         self.__current_line += 1
-        self.__current_command = self.__input_lines[self.__current_line]
+        self.__current = self.__instructions[self.__current_line]
+
+    def command_count(self) -> int:
+        """
+        Returns:
+            int: the number of commands in the input, including labels. This
+            is an upper bound on the number of instructions in the program.
+        """
+        return len(self.__instructions)
+
+    def instructions(self) -> typing.List[Instruction]:
+        """
+        Returns:
+            typing.List[Instruction]: all the tokenized commands of the input.
+        """
+        return self.__instructions
+
+    def set_instructions(self, instructions: typing.List[Instruction]) -> None:
+        """Replaces the commands of the input, e.g. with optimized ones, and
+        resets the parser.
+
+        Args:
+            instructions (typing.List[Instruction]): the new commands.
+        """
+        self.__instructions = instructions
+        self.reset_parser()
+
+    def current(self) -> Instruction:
+        """
+        Returns:
+            Instruction: the record of the current command.
+        """
+        return self.__current
 
     def reset_parser(self) -> None:
         '''Resets the parser to the beginning of the input.'''
         self.__current_line = -1
-        self.__current_command = ''
+        self.__current = None
 
-    
     def command_type(self) -> str:
         """
         Returns:
@@ -72,13 +181,7 @@ class Parser:
             "C_COMMAND" for dest=comp;jump
             "L_COMMAND" (actually, pseudo-command) for (Xxx) where Xxx is a symbol
         """
-        self.__current_command = self.__current_command.replace(" ", "").replace("\t", "")
-        if self.__current_command.startswith("(") :
-            return 'L_COMMAND'
-        elif self.__current_command.startswith("@"):
-            return 'A_COMMAND'
-        else:
-            return 'C_COMMAND'
+        return self.__current.command_type
 
     def symbol(self) -> str:
         """
@@ -87,12 +190,7 @@ class Parser:
             (Xxx). Should be called only when command_type() is "A_COMMAND" or 
             "L_COMMAND".
         """
-        if self.__current_command.startswith("(") :
-            symbol = self.__current_command.split(')')[0]
-            return symbol[1:]
-        elif self.__current_command.startswith("@"):
-            symbol = self.__current_command[1:]
-            return symbol
+        return self.__current.symbol
     
     def dest(self) -> str:
         """
@@ -100,11 +198,7 @@ class Parser:
             str: the dest mnemonic in the current C-command. Should be called 
             only when commandType() is "C_COMMAND".
         """
-        if "=" in self.__current_command :
-            parse_command = self.__current_command.split('=')
-            return parse_command[0]
-        else :
-            return 'null'
+        return self.__current.dest
 
     def comp(self) -> str:
         """
@@ -112,21 +206,7 @@ class Parser:
             str: the comp mnemonic in the current C-command. Should be called 
             only when commandType() is "C_COMMAND".
         """
-        comp = self.__current_command
-
-        if "=" in self.__current_command :
-            parse_command = self.__current_command.split('=')
-            if ";" in parse_command[1] :
-                parse_command = parse_command[1].split(';')
-                comp = parse_command[0]
-            else :
-                comp = parse_command[1]
-        elif ";" in self.__current_command :
-            parse_command = self.__current_command.split(';')
-            comp = parse_command[0]
-        
-        return comp
-
+        return self.__current.comp
 
     def jump(self) -> str:
         """
@@ -134,17 +214,4 @@ class Parser:
             str: the jump mnemonic in the current C-command. Should be called 
             only when commandType() is "C_COMMAND".
         """
-        jump = 'null'
-
-        if "=" in self.__current_command :
-            parse_command = self.__current_command.split('=')
-            if ";" in parse_command[1] :
-                parse_command = parse_command[1].split(';')
-                if parse_command[1] != "" :
-                    jump = parse_command[1]
-        elif  ";" in self.__current_command :
-            parse_command = self.__current_command.split(';')
-            if parse_command[1] != "" :
-                    jump = parse_command[1]
-        
-        return jump
\ No newline at end of file
+        return self.__current.jump
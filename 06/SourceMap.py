@@ -0,0 +1,207 @@
+"""
+Binary source maps from ROM addresses back to .asm source lines.
+"""
+import array
+import re
+import struct
+import typing
+from Parser import Instruction, L_COMMAND
+
+
+class SourceMap:
+    """Maps every ROM address of a program back to its .asm source line,
+    and to the comment that starts the block of the instruction, if there
+    is one. The VM translator writes a comment like "// push local 0" before
+    the code of every VM command (and of every shared routine), so for its
+    output the comment names the VM command that the instruction came from.
+    Other comments, like those inside the code of call and return, do not
+    start a block (see COMMAND_COMMENT).
+
+    The binary format is a 16-byte header followed by a string table and the
+    entries, all of them unsigned LEB128 varints:
+
+        offset 0:  magic b"HMAP"
+        offset 4:  uint16 format version
+        offset 6:  uint16 flags (reserved, always 0)
+        offset 8:  uint32 number of entries (the ROM size)
+        offset 12: uint32 number of strings
+        then:      every string, as its UTF-8 length and bytes
+        then:      every entry, as the zigzag-encoded difference of its line
+                   from the line of the previous entry, followed by the
+                   zigzag-encoded difference of its string index plus one
+                   (zero means no comment) from that of the previous entry
+
+    Consecutive instructions are usually on consecutive lines and share a
+    comment, so most entries take two bytes.
+    """
+
+    MAGIC = b"HMAP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHII")
+
+    # the comments that the VM translator writes before the code of a command
+    # or of a shared routine
+    COMMAND_COMMENT = re.compile(
+        r"(?:push|pop) \S+ \d+|\S+ operation|"
+        r"(?:label|goto|if-goto|if-not-goto|write function) \S+|"
+        r"call \S+ \d+|return|bootstrap|halt|shared \S+ routine")
+
+    def __init__(self, lines: array.array, comments: array.array,
+                 strings: typing.List[str]) -> None:
+        """Creates a new source map.
+
+        Args:
+            lines (array.array): the 1-based source line of every ROM
+                address, with typecode 'I'.
+            comments (array.array): the index in strings of the comment of
+                every ROM address, or -1 for none, with typecode 'i'.
+            strings (typing.List[str]): the distinct comments.
+        """
+        self.lines = lines
+        self.comments = comments
+        self.strings = strings
+
+    @staticmethod
+    def build(source: typing.Sequence[str],
+              instructions: typing.Iterable[Instruction]) -> "SourceMap":
+        """
+        Args:
+            source (typing.Sequence[str]): the raw lines of the source,
+                including the comments.
+            instructions (typing.Iterable[Instruction]): the assembled
+                commands, in ROM order, including labels.
+
+        Returns:
+            SourceMap: the source map of the program.
+        """
+        # the comment in effect on every line: that of the last command
+        # comment at or before it
+        line_comments = array.array('i', bytes(4 * (len(source) + 1)))
+        string_ids = {}
+        comment = -1
+        command_comment = SourceMap.COMMAND_COMMENT.fullmatch
+        for line_number, line in enumerate(source, 1):
+            line = line.strip()
+            if line.startswith("//"):
+                text = line[2:].strip()
+                if command_comment(text):
+                    comment = string_ids.get(text)
+                    if comment is None:
+                        comment = string_ids[text] = len(string_ids)
+            line_comments[line_number] = comment
+
+        lines = array.array('I')
+        comments = array.array('i')
+        for instruction in instructions:
+            if instruction.command_type == L_COMMAND:
+                continue
+            lines.append(instruction.line)
+            comments.append(line_comments[instruction.line]
+                            if instruction.line < len(line_comments) else -1)
+        return SourceMap(lines, comments, list(string_ids))
+
+    def lookup(self, rom_address: int
+               ) -> typing.Tuple[int, typing.Optional[str]]:
+        """
+        Args:
+            rom_address (int): a ROM address of the program.
+
+        Returns:
+            typing.Tuple[int, typing.Optional[str]]: the source line of the
+            instruction at the address, and the comment of its block, or None
+            if it has none.
+        """
+        comment = self.comments[rom_address]
+        return self.lines[rom_address], \
+            self.strings[comment] if comment >= 0 else None
+
+    @staticmethod
+    def __write_varint(value: int, output: bytearray) -> None:
+        while value > 0x7F:
+            output.append(value & 0x7F | 0x80)
+            value >>= 7
+        output.append(value)
+
+    @staticmethod
+    def __read_varint(data: bytes, offset: int) -> typing.Tuple[int, int]:
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+
+    def encode(self) -> bytes:
+        """
+        Returns:
+            bytes: the source map in the binary format.
+        """
+        write_varint = SourceMap.__write_varint
+        output = bytearray(SourceMap.HEADER.pack(
+            SourceMap.MAGIC, SourceMap.VERSION, 0, len(self.lines),
+            len(self.strings)))
+        for string in self.strings:
+            encoded = string.encode()
+            write_varint(len(encoded), output)
+            output += encoded
+        previous_line = 0
+        previous_comment = 0
+        for line, comment in zip(self.lines, self.comments):
+            delta = line - previous_line
+            write_varint(delta << 1 if delta >= 0 else (-delta << 1) - 1,
+                         output)
+            comment += 1
+            delta = comment - previous_comment
+            write_varint(delta << 1 if delta >= 0 else (-delta << 1) - 1,
+                         output)
+            previous_line, previous_comment = line, comment
+        return bytes(output)
+
+    def write(self, output_file: typing.BinaryIO) -> None:
+        """Writes the source map in the binary format.
+
+        Args:
+            output_file (typing.BinaryIO): the output file.
+        """
+        output_file.write(self.encode())
+
+    @staticmethod
+    def decode(data: bytes) -> "SourceMap":
+        """
+        Args:
+            data (bytes): a source map in the binary format.
+
+        Returns:
+            SourceMap: the source map.
+        """
+        magic, version, flags, count, string_count = \
+            SourceMap.HEADER.unpack_from(data)
+        if magic != SourceMap.MAGIC:
+            raise ValueError("not a source map")
+        if version != SourceMap.VERSION:
+            raise ValueError(f"unsupported source map version {version}")
+        read_varint = SourceMap.__read_varint
+        offset = SourceMap.HEADER.size
+        strings = []
+        for _ in range(string_count):
+            length, offset = read_varint(data, offset)
+            strings.append(bytes(data[offset:offset + length]).decode())
+            offset += length
+        lines = array.array('I')
+        comments = array.array('i')
+        line = 0
+        comment = 0
+        try:
+            for _ in range(count):
+                delta, offset = read_varint(data, offset)
+                line += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+                delta, offset = read_varint(data, offset)
+                comment += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+                lines.append(line)
+                comments.append(comment - 1)
+        except IndexError:
+            raise ValueError("truncated source map") from None
+        return SourceMap(lines, comments, strings)
@@ -5,12 +5,19 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import array
+import typing
 
 
 class SymbolTable:
     """
-    A symbol table that keeps a correspondence between symbolic labels and 
+    A symbol table that keeps a correspondence between symbolic labels and
     numeric addresses.
+
+    Every symbol is interned to a small integer id, and the addresses and
+    kinds of the symbols are kept in arrays indexed by id. The predefined
+    symbols are shared by all the tables, and a table copies them only when
+    it is first written to.
     """
 
     __init_table = {"SP":0,"LCL":1,"ARG":2,
@@ -22,26 +29,64 @@ class SymbolTable:
                   "R13":13,"R14":14,"R15":15}
     init_free_address = 16
 
+    # symbol kinds
+    PREDEFINED = 0
+    LABEL = 1
+    VARIABLE = 2
+
+    # the predefined symbols, interned once and shared by all the tables
+    __predefined_names = list(__init_table)
+    __predefined_ids = {symbol: symbol_id for symbol_id, symbol
+                        in enumerate(__predefined_names)}
+    __predefined_addresses = array.array('i', __init_table.values())
+    __predefined_kinds = array.array('B', [PREDEFINED] * len(__init_table))
+
     def __init__(self) -> None:
         """Creates a new symbol table initialized with all the predefined symbols
         and their pre-allocated RAM addresses, according to section 6.2.3 of the
         book.
         """
-        self.__table = SymbolTable.__init_table.copy()
+        self.__ids = SymbolTable.__predefined_ids
+        self.__names = SymbolTable.__predefined_names
+        self.__addresses = SymbolTable.__predefined_addresses
+        self.__kinds = SymbolTable.__predefined_kinds
+        self.__shared = True
         self.__free_address = SymbolTable.init_free_address
 
+    def __set(self, symbol: str, address: int, kind: int) -> None:
+        """Sets the address and kind of a symbol, interning it if needed.
+        The shared predefined entries are copied before the first write.
+        """
+        if self.__shared:
+            self.__ids = dict(self.__ids)
+            self.__names = list(self.__names)
+            self.__addresses = array.array('i', self.__addresses)
+            self.__kinds = array.array('B', self.__kinds)
+            self.__shared = False
+        symbol_id = self.__ids.get(symbol)
+        if symbol_id is None:
+            self.__ids[symbol] = len(self.__names)
+            self.__names.append(symbol)
+            self.__addresses.append(address)
+            self.__kinds.append(kind)
+        else:
+            self.__addresses[symbol_id] = address
+            self.__kinds[symbol_id] = kind
+
     def add_entry(self, symbol: str, address: int) -> None:
         """Adds the pair (symbol, address) to the table.
 
         Args:
             symbol (str): the symbol to add.
-            address (int): the address corresponding to the symbol.
+            address (int): the address corresponding to the symbol, or -1 to
+                allocate the next free RAM address to the symbol.
         """
-        self.__table[symbol] = address   
         if address == -1:
-            self.__table[symbol] = self.__free_address
-            self.__free_address += 1    
-    
+            self.__set(symbol, self.__free_address, SymbolTable.VARIABLE)
+            self.__free_address += 1
+        else:
+            self.__set(symbol, address, SymbolTable.LABEL)
+
     def contains(self, symbol: str) -> bool:
         """Does the symbol table contain the given symbol?
 
@@ -51,8 +96,8 @@ class SymbolTable:
         Returns:
             bool: True if the symbol is contained, False otherwise.
         """
-        return symbol in self.__table
-    
+        return symbol in self.__ids
+
     def get_address(self, symbol: str) -> int:
         """Returns the address associated with the symbol.
 
@@ -62,5 +107,72 @@ class SymbolTable:
         Returns:
             int: the address associated with the symbol.
         """
-        return self.__table[symbol]
-    
\ No newline at end of file
+        return self.__addresses[self.__ids[symbol]]
+
+    def lookup(self, symbol: str) -> typing.Optional[int]:
+        """
+        Args:
+            symbol (str): a symbol.
+
+        Returns:
+            typing.Optional[int]: the address associated with the symbol, or
+            None if the symbol is not in the table.
+        """
+        symbol_id = self.__ids.get(symbol)
+        if symbol_id is None:
+            return None
+        return self.__addresses[symbol_id]
+
+    def resolve_or_allocate(self, symbol: str) -> int:
+        """Returns the address associated with the symbol. A symbol that is
+        not in the table is a variable, and the next free RAM address is
+        allocated to it first. This takes a single lookup, instead of
+        contains() followed by get_address().
+
+        Args:
+            symbol (str): a symbol.
+
+        Returns:
+            int: the address associated with the symbol.
+        """
+        symbol_id = self.__ids.get(symbol)
+        if symbol_id is not None:
+            return self.__addresses[symbol_id]
+        address = self.__free_address
+        self.__set(symbol, address, SymbolTable.VARIABLE)
+        self.__free_address += 1
+        return address
+
+    def export(self) -> typing.Tuple[typing.List[str], array.array,
+                                     array.array]:
+        """Exports the whole table at once, indexed by symbol id.
+
+        Returns:
+            typing.Tuple[typing.List[str], array.array, array.array]: the
+            symbols, their addresses (typecode 'i') and their kinds (typecode
+            'B', one of PREDEFINED, LABEL and VARIABLE). These are copies, so
+            they may be modified freely.
+        """
+        return (list(self.__names), array.array('i', self.__addresses),
+                array.array('B', self.__kinds))
+
+    def __of_kind(self, kind: int) -> typing.Dict[str, int]:
+        return {symbol: address for symbol, address, symbol_kind
+                in zip(self.__names, self.__addresses, self.__kinds)
+                if symbol_kind == kind}
+
+    def labels(self) -> typing.Dict[str, int]:
+        """
+        Returns:
+            typing.Dict[str, int]: the labels and their ROM addresses, in
+            order of declaration.
+        """
+        return self.__of_kind(SymbolTable.LABEL)
+
+    def variables(self) -> typing.Dict[str, int]:
+        """
+        Returns:
+            typing.Dict[str, int]: the variables and their RAM addresses, in
+            order of allocation.
+        """
+        return self.__of_kind(SymbolTable.VARIABLE)
@@ -0,0 +1,153 @@
+"""
+Checks the rewrites of the peephole optimizer, and that it leaves alone
+programs that jump to numeric ROM addresses.
+"""
+import io
+import os
+import typing
+import unittest
+import Main
+from Optimizer import Optimizer
+from Parser import Instruction, Parser
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# sample programs that jump to numeric addresses instead of labels
+NUMERIC_JUMP_PROGRAMS = ("max/MaxL.asm", "rect/RectL.asm", "pong/PongL.asm")
+
+
+def assemble(program: str, optimize_mode: bool = False) -> str:
+    output_file = io.StringIO()
+    with open(os.path.join(DIRECTORY, program)) as input_file:
+        Main.assemble_file(input_file, output_file,
+                           optimize_mode=optimize_mode)
+    return output_file.getvalue()
+
+
+def lex(source: str) -> typing.List[Instruction]:
+    """Tokenizes a program given as white space separated commands."""
+    return list(Parser.lex(source.split()))
+
+
+def texts(instructions: typing.List[Instruction]) -> typing.List[str]:
+    return [str(instruction) for instruction in instructions]
+
+
+class FoldIncrementsTest(unittest.TestCase):
+
+    def test_undone_increment(self) -> None:
+        for source in ("@SP M=M+1 @SP M=M-1 D=M", "@SP M=M-1 @SP M=M+1 D=M"):
+            with self.subTest(source=source):
+                self.assertEqual(
+                    texts(Optimizer.fold_increments(lex(source))),
+                    ["@SP", "D=M"])
+
+    def test_push_popped_back(self) -> None:
+        source = "@SP M=M+1 A=M-1 M=D @SP M=M-1 A=M D=M D=D+1"
+        self.assertEqual(texts(Optimizer.fold_increments(lex(source))),
+                         ["@SP", "A=M", "M=D", "D=D+1"])
+
+    def test_different_addresses(self) -> None:
+        source = "@SP M=M+1 @R13 M=M-1"
+        self.assertEqual(texts(Optimizer.fold_increments(lex(source))),
+                         source.split())
+
+
+class RemoveRedundantLoadsTest(unittest.TestCase):
+
+    def test_reload(self) -> None:
+        self.assertEqual(
+            texts(Optimizer.remove_redundant_loads(lex("@X D=M @X M=D+1"))),
+            ["@X", "D=M", "M=D+1"])
+
+    def test_reload_after_label_or_a_write(self) -> None:
+        for source in ("@X D=M (L) @X M=D", "@X A=M @X M=D",
+                       "@X AM=M+1 @X M=D"):
+            with self.subTest(source=source):
+                self.assertEqual(
+                    texts(Optimizer.remove_redundant_loads(lex(source))),
+                    source.split())
+
+
+class RemoveUnreachableTest(unittest.TestCase):
+
+    def test_after_unconditional_jump(self) -> None:
+        for jump in ("0;JMP", "D;JMP", "0;JEQ", "1;JGT", "-1;JNE"):
+            with self.subTest(jump=jump):
+                source = "@L " + jump + " @X M=0 (L) D=0"
+                self.assertEqual(
+                    texts(Optimizer.remove_unreachable(lex(source))),
+                    ["@L", jump, "(L)", "D=0"])
+
+    def test_after_conditional_jump(self) -> None:
+        for jump in ("D;JEQ", "0;JNE", "1;JLT"):
+            with self.subTest(jump=jump):
+                source = "@L " + jump + " @X M=0 (L) D=0"
+                self.assertEqual(
+                    texts(Optimizer.remove_unreachable(lex(source))),
+                    source.split())
+
+
+class ThreadJumpsTest(unittest.TestCase):
+
+    def assertThreaded(self, source: str, expected: str) -> None:
+        instructions = lex(source)
+        self.assertEqual(Optimizer.thread_jumps(instructions),
+                         source != expected)
+        self.assertEqual(texts(instructions), expected.split())
+
+    def test_trampoline(self) -> None:
+        self.assertThreaded("@L D;JGT @X M=D (L) @T 0;JMP (T) D=0",
+                            "@T D;JGT @X M=D (L) @T 0;JMP (T) D=0")
+
+    def test_chain(self) -> None:
+        self.assertThreaded("@L 0;JMP (L) @M 0;JMP (M) @T 0;JMP (T) D=0",
+                            "@T 0;JMP (L) @T 0;JMP (M) @T 0;JMP (T) D=0")
+
+    def test_cycle(self) -> None:
+        source = "@L 0;JMP (L) @M 0;JMP (M) @L 0;JMP"
+        self.assertThreaded(source, source)
+
+    def test_observable_jumps(self) -> None:
+        for jump in ("A;JMP", "M;JGT", "M=D;JGT", "A=D;JMP", "AD=D;JMP"):
+            with self.subTest(jump=jump):
+                source = "@L " + jump + " @X (L) @T 0;JMP (T) D=0"
+                self.assertThreaded(source, source)
+
+    def test_fall_through_with_a(self) -> None:
+        for source in ("@L D;JGT D=A (L) @T 0;JMP (T) D=0",
+                       "@L D;JGT (K) D=A (L) @T 0;JMP (T) D=0"):
+            with self.subTest(source=source):
+                self.assertThreaded(source, source)
+
+    def test_jump_writes_a(self) -> None:
+        # stores 6, the address of T, in R0; threading the jump would make
+        # it jump straight to T with A still holding 7
+        source = "\n".join(
+            "@7 D=A @L A=D;JMP (L) @T 0;JMP (T) D=A @R0 M=D".split())
+        self.assertEqual(Main.assemble(source),
+                         Main.assemble(source, optimize_mode=True))
+
+
+class NumericJumpsTest(unittest.TestCase):
+
+    def test_jumps_to_addresses(self) -> None:
+        for source, expected in (("@133 0;JMP", True), ("@0 D;JGT", True),
+                                 ("@L 0;JMP", False), ("@133 D=A", False)):
+            with self.subTest(source=source):
+                self.assertEqual(Optimizer.jumps_to_addresses(lex(source)),
+                                 expected)
+
+    def test_optimize_keeps_instructions(self) -> None:
+        instructions = lex("@SP M=M+1 @SP M=M-1 @4 0;JMP @X M=0")
+        self.assertEqual(Optimizer.optimize(instructions), instructions)
+
+    def test_optimize_mode_keeps_words(self) -> None:
+        for program in NUMERIC_JUMP_PROGRAMS:
+            with self.subTest(program=program):
+                self.assertEqual(assemble(program),
+                                 assemble(program, optimize_mode=True))
+
+
+if "__main__" == __name__:
+    unittest.main()
@@ -5,6 +5,8 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import io
+import os
 import typing
       
 class CodeWriter:
@@ -30,124 +32,71 @@ class CodeWriter:
                       "M=D\n" + \
                       POP_SP_ASM
 
-  POP_TEMP_ASM = "// pop temp {0}\n"\
-                      "@{0}\n" \
-                      "D=A\n" \
-                      "@{1}\n" \
-                      "D=D+A\n" \
-                      "@R13\n" \
-                      "M=D\n" +\
-                      POP_SP_ASM
-
-  POP_STATIC = "// pop static\n"\
-                  "@SP\n" \
-                  "M=M-1\n" \
-                  "A=M\n" \
-                  "D=M\n" \
-                  "@{0}\n" \
-                  "M=D\n"
-  
-  POP_POINTER = "// pop pointer {0}\n"\
-                  "@{0}\n" \
-                  "D=A\n" \
-                  "@{1}\n" \
-                  "D=D+A\n" \
-                  "@R13\n" \
-                  "M=D\n" +\
-                  POP_SP_ASM
-                  
-                
   PUSH_SP_ASM = "@SP\n" \
                 "M=M+1\n" \
                 "A=M-1\n" \
                 "M=D\n"
   
-  PUSH_STATIC_ASM = "// push static {0}\n"\
-                  "@{1}\n" \
-                  "D=M\n" +\
-                  PUSH_SP_ASM
-  
-  
-  PUSH_POINTER_ASM = "// push pointer {0}\n"\
-                  "@{0}\n" \
-                  "D=A\n" \
-                  "@{1}\n" \
-                  "A=A+D\n" \
-                  "D=M\n" +\
-                  PUSH_SP_ASM
-  
-
-  CONST_PUSH_ASM = "// push const {0}\n" \
-                  "@{0}\n" \
-                  "D=A\n" +\
-                  PUSH_SP_ASM
-
-  PUSH_TEMP_ASM = "// push temp {0}\n" \
-                  "@{0}\n" \
-                  "D=A\n" \
-                  "@{1}\n" \
-                  "A=A+D\n" \
-                  "D=M\n" +\
-                  PUSH_SP_ASM
-
-  PUSH_REG_ASM = "// push {0} {1}\n" \
-                  "@{1}\n" \
-                  "D=A\n" \
-                  "@{2}\n" \
-                  "D=D+M\n" \
-                  "A=D\n" \
-                  "D=M\n" +\
-                  PUSH_SP_ASM
-
+  # x - y is 0 exactly when x == y, even when it overflows, so eq needs no
+  # sign checks. D is 0 if they are equal and 1 otherwise, and true (-1) or
+  # false (0) is D-1.
+  #USAGE: 1 -> command, 2 -> label suffix
+  EQ_ASM = "// {0} operation\n" \
+      "@SP\n" \
+      "AM=M-1\n" \
+      "D=M\n" \
+      "A=A-1\n" \
+      "D=M-D\n" \
+      "@EQUAL{1}\n" \
+      "D;JEQ\n" \
+      "D=1\n" \
+      "(EQUAL{1})\n" \
+      "@SP\n" \
+      "A=M-1\n" \
+      "M=D-1\n"
+
+  # x - y may overflow only when x and y have different signs, and then the
+  # sign of x decides. So D gets x - y when the signs are the same, and a
+  # value of the right sign when they differ, and the result is written as
+  # true, and overwritten with false unless D passes the jump. y is read
+  # again from the stack, which still holds it, instead of saving it.
+  #USAGE: 1 -> command, 2 -> label suffix, 3 -> jump mnemonic
   COMPARE_ASM = "// {0} operation\n" \
-              "@SP\n" \
-              "M=M-1\n" \
-              "A=M\n" \
-              "D=M\n" \
-              "@R13\n" \
-              "M=D\n" \
-              "@Y_NEGATIVE" + "{1}\n" \
-              "D;JLT\n" \
-              "@SP\n" \
-              "A=M-1\n" \
-              "D=M\n" \
-              "@X_NEGATIVE" + "{1}\n" \
-              "D;JLT\n" \
-              "@R13\n" \
-              "D=D-M\n" \
-              "@INSERT" + "{1}\n" \
-              "0;JMP\n" \
-              "(Y_NEGATIVE" + "{1})\n" \
-              "@SP\n" \
-              "A=M-1\n" \
-              "D=M\n" \
-              "@Y_X_NEGATIVE" + "{1}\n" \
-              "D;JLT\n" \
-              "D=1\n" \
-              "@INSERT" + "{1}\n" \
-              "0;JMP\n" \
-              "(X_NEGATIVE" + "{1})\n" \
-              "D = -1\n"\
-              "@INSERT" + "{1}\n" \
-              "0;JMP\n" \
-              "(Y_X_NEGATIVE" + "{1})\n" \
-              "@R13\n" \
-              "D=D-M\n" \
-              "@INSERT" + "{1}\n" \
-              "0;JMP\n" \
-              "(INSERT" + "{1})\n" \
-              "@INESRT_TRUE" + "{1}\n" \
-              "D;{2}\n" \
-              "@SP\n" \
-              "A=M-1\n" \
-              "M=0\n" \
-              "@CONTINUE" + "{1}\n" \
-              "0;JMP\n" \
-              "(INESRT_TRUE" + "{1})\n" \
-              "@SP\n" \
-              "A=M-1\n" \
-              "M=-1\n" \
-              "(CONTINUE" + "{1})\n"
+      "@SP\n" \
+      "AM=M-1\n" \
+      "D=M\n" \
+      "@Y_NEGATIVE{1}\n" \
+      "D;JLT\n" \
+      "@SP\n" \
+      "A=M-1\n" \
+      "D=M\n" \
+      "@COMPARE{1}\n" \
+      "D;JLT\n" \
+      "(SUBTRACT{1})\n" \
+      "@SP\n" \
+      "A=M\n" \
+      "D=M\n" \
+      "A=A-1\n" \
+      "D=M-D\n" \
+      "@COMPARE{1}\n" \
+      "0;JMP\n" \
+      "(Y_NEGATIVE{1})\n" \
+      "@SP\n" \
+      "A=M-1\n" \
+      "D=M\n" \
+      "@SUBTRACT{1}\n" \
+      "D;JLT\n" \
+      "D=1\n" \
+      "(COMPARE{1})\n" \
+      "@SP\n" \
+      "A=M-1\n" \
+      "M=-1\n" \
+      "@CONTINUE{1}\n" \
+      "D;{2}\n" \
+      "@SP\n" \
+      "A=M-1\n" \
+      "M=0\n" \
+      "(CONTINUE{1})\n"
 
   BIT_OP_ASM = "// {0} operation\n" \
       "@SP\n" \
@@ -223,6 +172,9 @@ class CodeWriter:
       "A=M\n" \
       "0;JMP\n"
 
+  #USAGE: 1 -> function name, 2 -> number of arguments
+  CALL_ASM = "// call {0} {1}\n"
+
   #USAGE: 1 -> return label
   PUSH_RETURN_LABEL = "// push return label\n" \
     "@{0}\n" \
@@ -255,40 +207,368 @@ class CodeWriter:
       "@{0}\n" \
       "0;JMP\n"
 
+  # the parts of call and return that have no parameters, formatted once
+
+  # saves the frame of the caller
+  SAVE_FRAME_ASM = PUSH_ENV_FIELD.format("LCL") + \
+      PUSH_ENV_FIELD.format("ARG") + \
+      PUSH_ENV_FIELD.format("THIS") + \
+      PUSH_ENV_FIELD.format("THAT")
+
+  # all of return, see write_return
+  RETURN_BODY_ASM = RET_AND_LCL_ADDRESS_ASM + \
+      "// *ARG = pop()\n" \
+      "@SP\n" \
+      "AM=M-1\n" \
+      "D=M\n" \
+      "@ARG\n" \
+      "A=M\n" \
+      "M=D\n" + \
+      SP_TO_ARG_PLUS_1_ASM + \
+      END_FRAME_ASM.format(1, "THAT") + \
+      END_FRAME_ASM.format(2, "THIS") + \
+      END_FRAME_ASM.format(3, "ARG") + \
+      END_FRAME_ASM.format(4, "LCL") + \
+      RETURN_ASM
+
   #USAGE: 1 -> caller name, 2 -> filename, 3 -> label counter
   GENERATE_RETURN_LABEL = "{0}$ret.{1}"
-  comp_op, function_counter = 0, 0
 
-  def __init__(self, output_file: typing.TextIO) -> None:
+  #USAGE: 1 -> filename, 2 -> label counter
+  GENERATE_COMPARE_SUFFIX = "{0}.{1}"
+
+  # size-optimized mode: every call site jumps into a single shared routine
+
+  # entry labels of the shared routines
+  CALL_ROUTINE = "__VM_CALL"
+  RETURN_ROUTINE = "__VM_RETURN"
+  COMPARE_ROUTINE = "__VM_{0}"
+
+  #USAGE: 1 -> command, 2 -> return label, 3 -> routine
+  COMPARE_SITE_ASM = "// {0} operation\n" \
+      "@{1}\n" \
+      "D=A\n" \
+      "@{2}\n" \
+      "0;JMP\n" \
+      "({1})\n"
+
+  #USAGE: 1 -> function name, 2 -> n_args, 3 -> n_args + 5, 4 -> return label
+  CALL_SITE_ASM = "// call {0} {1}\n" \
+      "@{2}\n" \
+      "D=A\n" \
+      "@R13\n" \
+      "M=D\n" \
+      "@{0}\n" \
+      "D=A\n" \
+      "@R14\n" \
+      "M=D\n" \
+      "@{3}\n" \
+      "D=A\n" \
+      "@" + CALL_ROUTINE + "\n" \
+      "0;JMP\n" \
+      "({3})\n"
+
+  RETURN_SITE_ASM = "// return\n" \
+      "@" + RETURN_ROUTINE + "\n" \
+      "0;JMP\n"
+
+  # the return address is in D, and the routine returns through R15. The
+  # routine label doubles as the suffix of the labels of the compare code.
+  #USAGE: 1 -> command, 2 -> routine, 3 -> the compare code
+  COMPARE_ROUTINE_ASM = "// shared {0} routine\n" \
+      "({1})\n" \
+      "@R15\n" \
+      "M=D\n" \
+      "{2}" \
+      "@R15\n" \
+      "A=M\n" \
+      "0;JMP\n"
+
+  # the return address is in D, n_args + 5 in R13 and the callee in R14
+  CALL_ROUTINE_ASM = "// shared call routine\n" \
+      "(" + CALL_ROUTINE + ")\n" + \
+      PUSH_SP_ASM + \
+      SAVE_FRAME_ASM + \
+      "// ARG = SP-5-n_args\n" \
+      "@SP\n" \
+      "D=M\n" \
+      "@R13\n" \
+      "D=D-M\n" \
+      "@ARG\n" \
+      "M=D\n" + \
+      SET_LCL_EQ_SP + \
+      "// jump to func\n" \
+      "@R14\n" \
+      "A=M\n" \
+      "0;JMP\n"
+
+  RETURN_ROUTINE_ASM = "// shared return routine\n" \
+      "(" + RETURN_ROUTINE + ")\n" + \
+      RETURN_BODY_ASM
+
+  # keeps execution from falling into the shared routines
+  HALT_ASM = "// halt\n" \
+      "(__VM_HALT)\n" \
+      "@__VM_HALT\n" \
+      "0;JMP\n"
+
+  # stack caching mode: the top of the stack may be kept in D instead of
+  # memory, in which case SP does not count it
+
+  # moves the cached top of the stack to memory
+  SPILL_ASM = PUSH_SP_ASM
+
+  # moves the top of the stack from memory to D
+  FILL_ASM = "@SP\n" \
+      "AM=M-1\n" \
+      "D=M\n"
+
+  #USAGE: 1 -> command, 2 -> comp of the top of the stack (D) and the value
+  # below it (M)
+  CACHED_BINARY_OP_ASM = "// {0} operation\n" \
+      "@SP\n" \
+      "AM=M-1\n" \
+      "D={1}\n"
+
+  #USAGE: 1 -> command, 2 -> comp of the top of the stack (D)
+  CACHED_UNARY_OP_ASM = "// {0} operation\n" \
+      "D={1}\n"
+
+  # loading D from and storing D to a segment entry, which the pushes and pops
+  # of both modes are made of
+
+  #USAGE: 1 -> constant
+  CACHED_CONST_PUSH_ASM = "// push constant {0}\n" \
+      "@{0}\n" \
+      "D=A\n"
+
+  #USAGE: 1 -> constant, one of SHORT_CONSTANTS
+  CACHED_SHORT_CONST_PUSH_ASM = "// push constant {0}\n" \
+      "D={0}\n"
+
+  #USAGE: 1 -> constant, one of SHORT_CONSTANTS
+  PUSH_SHORT_CONST_ASM = "// push constant {0}\n" \
+      "@SP\n" \
+      "M=M+1\n" \
+      "A=M-1\n" \
+      "M={0}\n"
+
+  #USAGE: 1 -> segment, 2 -> index, 3 -> address
+  CACHED_PUSH_ADDRESS_ASM = "// push {0} {1}\n" \
+      "@{2}\n" \
+      "D=M\n"
+
+  #USAGE: 1 -> segment, 2 -> index, 3 -> segment register
+  CACHED_PUSH_REG_ASM = "// push {0} {1}\n" \
+      "@{1}\n" \
+      "D=A\n" \
+      "@{2}\n" \
+      "A=D+M\n" \
+      "D=M\n"
+
+  #USAGE: 1 -> segment, 2 -> index, 3 -> segment register, 4 -> the entry
+  # of NEAR_OFFSETS for the index
+  CACHED_PUSH_NEAR_REG_ASM = "// push {0} {1}\n" \
+      "@{2}\n" \
+      "A=M{3}\n" \
+      "D=M\n"
+
+  #USAGE: 1 -> segment, 2 -> index, 3 -> address
+  CACHED_POP_ADDRESS_ASM = "// pop {0} {1}\n" \
+      "@{2}\n" \
+      "M=D\n"
+
+  #USAGE: 1 -> segment, 2 -> index, 3 -> segment register, 4 -> "A=A+1\n"
+  # for every unit of the index
+  CACHED_POP_NEAR_REG_ASM = "// pop {0} {1}\n" \
+      "@{2}\n" \
+      "A=M\n" \
+      "{3}" \
+      "M=D\n"
+
+  #USAGE: 1 -> segment, 2 -> index, 3 -> segment register
+  CACHED_POP_REG_ASM = "// pop {0} {1}\n" \
+      "@R13\n" \
+      "M=D\n" \
+      "@{1}\n" \
+      "D=A\n" \
+      "@{2}\n" \
+      "D=D+M\n" \
+      "@R14\n" \
+      "M=D\n" \
+      "@R13\n" \
+      "D=M\n" \
+      "@R14\n" \
+      "A=M\n" \
+      "M=D\n"
+
+  # eq with y cached in D, which leaves the result cached in D, see EQ_ASM
+  #USAGE: 1 -> label suffix
+  CACHED_EQ_ASM = "// eq operation\n" \
+      "@SP\n" \
+      "AM=M-1\n" \
+      "D=M-D\n" \
+      "@EQUAL{0}\n" \
+      "D;JEQ\n" \
+      "D=1\n" \
+      "(EQUAL{0})\n" \
+      "D=D-1\n"
+
+  #USAGE: 1 -> function name, 2 -> label
+  CACHED_IF_GOTO_ASM = "// if-goto {0}${1}\n" \
+      "@{0}${1}\n" \
+      "D;JNE\n"
+
+  # the value in D is not -1 exactly when its bitwise not is not 0
+  #USAGE: 1 -> function name, 2 -> label
+  IF_NOT_GOTO_ASM = "// if-not-goto {0}${1}\n" \
+      "D=D+1\n" \
+      "@{0}${1}\n" \
+      "D;JNE\n"
+
+  # the constants that the comp field can produce by itself, without an
+  # A-instruction. -1 is not a VM constant, but the optimizer may fold to it.
+  SHORT_CONSTANTS = (-1, 0, 1)
+
+  # the comp offsets of the indices that are pushed without computing the
+  # address: A=M and A=M+1
+  NEAR_OFFSETS = ("", "+1")
+
+  # the largest index that is popped by incrementing A, which is shorter
+  # than computing the address
+  MAX_NEAR_INDEX = 6
+
+  # arithmetic command -> its code, for all but the comparisons, which need
+  # labels of their own
+  ARITHMETIC_ASM = {"add": BIT_OP_ASM.format("add", "+"),
+                    "sub": BIT_OP_ASM.format("sub", "-"),
+                    "and": BIT_OP_ASM.format("and", "&"),
+                    "or": BIT_OP_ASM.format("or", "|"),
+                    "neg": UNARY_OP.format("neg", "-M"),
+                    "not": UNARY_OP.format("not", "!M"),
+                    "shiftleft": UNARY_OP.format("shiftleft", "M<<"),
+                    "shiftright": UNARY_OP.format("shiftright", "M>>")}
+
+  # arithmetic command -> its code in stack caching mode, which computes the
+  # result from the top of the stack (D) and the value below it (M)
+  CACHED_ARITHMETIC_ASM = {
+    "add": CACHED_BINARY_OP_ASM.format("add", "D+M"),
+    "sub": CACHED_BINARY_OP_ASM.format("sub", "M-D"),
+    "and": CACHED_BINARY_OP_ASM.format("and", "D&M"),
+    "or": CACHED_BINARY_OP_ASM.format("or", "D|M"),
+    "neg": CACHED_UNARY_OP_ASM.format("neg", "-D"),
+    "not": CACHED_UNARY_OP_ASM.format("not", "!D"),
+    "shiftleft": CACHED_UNARY_OP_ASM.format("shiftleft", "D<<"),
+    "shiftright": CACHED_UNARY_OP_ASM.format("shiftright", "D>>")}
+
+  # the comparison commands, and the jump that is taken when they are true
+  COMPARE_JUMPS = {"eq": "JEQ", "lt": "JLT", "gt": "JGT"}
+
+  # the largest number of rendered pushes, pops, loads and stores that are
+  # kept, see __render
+  MEMO_SIZE = 4096
+  __memo = {}
+
+  # the number of characters that are buffered before they are written, in
+  # buffered mode
+  BUFFER_SIZE = 1 << 16
+
+  def __init__(self, output_file: typing.Union[typing.TextIO, typing.BinaryIO,
+                                               int],
+               size_optimized: bool = False,
+               stack_caching: bool = False, buffered: bool = False) -> None:
     """Initializes the CodeWriter.
 
     Args:
-          output_stream (typing.TextIO): output stream.
+          output_stream (typing.Union[typing.TextIO, typing.BinaryIO, int]):
+            output stream, which may also be a binary stream or a file
+            descriptor, that the code is written to as UTF-8.
+          size_optimized (bool): if this is True, comparisons, calls and
+            returns jump into shared routines instead of being inlined. The
+            routines are written once, by bootstrap().
+          stack_caching (bool): if this is True, the top of the stack is kept
+            in D across straight-line commands, and written to memory only
+            before labels, jumps, calls and returns. spill() must be called
+            after the last command.
+          buffered (bool): if this is True, the code is gathered in memory and
+            written in blocks of about BUFFER_SIZE characters. flush() must
+            be called after the last command.
     """
     self.__output_file = output_file
+    if isinstance(output_file, int):
+      self.__write_through = self.__write_descriptor
+    elif isinstance(output_file, (io.RawIOBase, io.BufferedIOBase)):
+      self.__write_through = lambda assembly: output_file.write(
+        assembly.encode())
+    else:
+      self.__write_through = output_file.write
+    self.__buffered = buffered
+    self.__chunks, self.__buffered_size = [], 0
+    self.__size_optimized = size_optimized
+    self.__stack_caching = stack_caching
+    # is the top of the stack in D rather than in memory?
+    self.__cached = False
     self.__file_name, self.__current_function = "", ''
+    # the generated labels are unique within a file, and are namespaced by
+    # the file (or the function, which belongs to it), so every file can be
+    # translated by its own CodeWriter, even in another process
+    self.__comp_op, self.__function_counter = 0, 0
     self.__segment_dic = {"local": "LCL", "argument": "ARG", "this": "THIS",
                   "that": "THAT", "temp": 5, "pointer": 3, "static": 16}
-    #self.comp_op = 0
-    # in order to write function label (e.g. foo$bar), this var store the current method
-    self.__command_functions = {
-    "add": lambda: self.__bit_op("add", "+"),
-    "sub": lambda: self.__bit_op("sub", "-"),
-    "eq": lambda: self.__cmp_op("eq"),
-    "lt": lambda: self.__cmp_op("lt"),
-    "gt": lambda: self.__cmp_op("gt"),
-    "neg": lambda: self.__unary_op("neg", "-"),
-    "shiftright": lambda: self.__unary_op("shiftright", ">>"),
-    "shiftleft": lambda: self.__unary_op("shiftleft", "<<"),
-    "and": lambda: self.__bit_op("and", "&"),
-    "or": lambda: self.__bit_op("or", "|"),
-    "not": lambda: self.__unary_op("not", "!"),
-    }
+
+  def __write_descriptor(self, assembly: str) -> None:
+    """Writes to the file descriptor, which may take more than one write."""
+    data = memoryview(assembly.encode())
+    while data:
+      data = data[os.write(self.__output_file, data):]
+
+  def __write(self, assembly: str) -> None:
+    """Writes assembly code, through the buffer in buffered mode."""
+    if not self.__buffered:
+      self.__write_through(assembly)
+      return
+    self.__chunks.append(assembly)
+    self.__buffered_size += len(assembly)
+    if self.__buffered_size >= CodeWriter.BUFFER_SIZE:
+      self.flush()
+
+  def write_assembly(self, assembly: str) -> None:
+    """Writes assembly code as is, for example the translation of another
+    file.
+
+    Args:
+        assembly (str): the assembly code.
+    """
+    self.__write(assembly)
+
+  def flush(self) -> None:
+    """Writes the buffered code to the output. This is a no-op unless the
+    CodeWriter is buffered."""
+    if self.__chunks:
+      self.__write_through("".join(self.__chunks))
+      self.__chunks, self.__buffered_size = [], 0
 
   def bootstrap(self) -> None:
-    """Writes the assembly code that is the translation of the bootstrap code."""
-    self.__output_file.write(CodeWriter.INIT_ASM)
+    """Writes the assembly code that is the translation of the bootstrap code,
+    followed by the shared routines in size-optimized mode."""
+    self.__write(CodeWriter.INIT_ASM)
     self.write_call(function_name="Sys.init", n_args=0)
+    if self.__size_optimized:
+      self.write_shared_routines()
+
+  def write_shared_routines(self) -> None:
+    """Writes the routines that the call sites of the size-optimized mode jump
+    into, behind a halt loop. They have to be written exactly once for the
+    whole program."""
+    routines = CodeWriter.HALT_ASM
+    for command, jump in CodeWriter.COMPARE_JUMPS.items():
+      routine = CodeWriter.COMPARE_ROUTINE.format(command.upper())
+      template = CodeWriter.EQ_ASM if command == "eq" else \
+        CodeWriter.COMPARE_ASM
+      routines += CodeWriter.COMPARE_ROUTINE_ASM.format(
+        command, routine, template.format(command, routine, jump))
+    routines += CodeWriter.CALL_ROUTINE_ASM + CodeWriter.RETURN_ROUTINE_ASM
+    self.__write(routines)
 
 
   def set_file_name(self, filename: str) -> None:
@@ -310,29 +590,175 @@ class CodeWriter:
     Args:
         command (str): an arithmetic command.
     """
-    if command in self.__command_functions:
-      self.__command_functions[command]()
-
-  def __unary_op(self, command: str, unary_op: str) -> None:
-    """Writes the assembly code that is the translation of the given unary operation command."""
-    if unary_op in ["<<", ">>"]:
-      self.__output_file.write(CodeWriter.UNARY_OP.format(command, "M" + unary_op))
-    else:
-      self.__output_file.write(CodeWriter.UNARY_OP.format(command, unary_op + "M"))
+    if self.__stack_caching and command in CodeWriter.CACHED_ARITHMETIC_ASM:
+      self.__fill()
+      self.__write(CodeWriter.CACHED_ARITHMETIC_ASM[command])
+      return
+    if command in CodeWriter.COMPARE_JUMPS:
+      self.__cmp_op(command)
+      return
+    self.spill()
+    if command in CodeWriter.ARITHMETIC_ASM:
+      self.__write(CodeWriter.ARITHMETIC_ASM[command])
+
+  def spill(self) -> None:
+    """Writes the top of the stack back to memory, if it is cached in D. This
+    is a no-op unless stack caching is enabled."""
+    if self.__cached:
+      self.__write(CodeWriter.SPILL_ASM)
+      self.__cached = False
+
+  def __fill(self) -> None:
+    """Moves the top of the stack to D, if it is not cached there yet."""
+    if not self.__cached:
+      self.__write(CodeWriter.FILL_ASM)
+      self.__cached = True
+
+  def __segment_address(self, segment: str, index: int) -> typing.Optional[str]:
+    """Returns the fixed address of a segment entry, or None for the segments
+    that are based on a register."""
+    if segment == "temp" or segment == "pointer":
+      return str(self.__segment_dic[segment] + int(index))
+    if segment == "static":
+      return f"{self.__file_name}.{index}"
+    return None
+
+  def __render(self, operation: str, segment: str, index: int) -> str:
+    """Returns the code of an operation on a segment entry: "load" (to D),
+    "store" (from D), or "C_PUSH" and "C_POP" in the form that does not cache
+    the top of the stack. The code only depends on the arguments, except for
+    static entries, so it is memoized for all the instances, up to
+    MEMO_SIZE entries."""
+    key = (operation, segment, index)
+    assembly = CodeWriter.__memo.get(key)
+    if assembly is None:
+      assembly = CodeWriter.__emitters[operation, segment](self, segment, index)
+      if segment != "static" and len(CodeWriter.__memo) < CodeWriter.MEMO_SIZE:
+        CodeWriter.__memo[key] = assembly
+    return assembly
+
+  def __load_constant(self, segment: str, index: int) -> str:
+    if int(index) in CodeWriter.SHORT_CONSTANTS:
+      return CodeWriter.CACHED_SHORT_CONST_PUSH_ASM.format(index)
+    return CodeWriter.CACHED_CONST_PUSH_ASM.format(index)
+
+  def __load_address(self, segment: str, index: int) -> str:
+    return CodeWriter.CACHED_PUSH_ADDRESS_ASM.format(
+      segment, index, self.__segment_address(segment, index))
+
+  def __load_register(self, segment: str, index: int) -> str:
+    if int(index) < len(CodeWriter.NEAR_OFFSETS):
+      return CodeWriter.CACHED_PUSH_NEAR_REG_ASM.format(
+        segment, index, self.__segment_dic[segment],
+        CodeWriter.NEAR_OFFSETS[int(index)])
+    return CodeWriter.CACHED_PUSH_REG_ASM.format(segment, index,
+                                                 self.__segment_dic[segment])
+
+  def __store_address(self, segment: str, index: int) -> str:
+    return CodeWriter.CACHED_POP_ADDRESS_ASM.format(
+      segment, index, self.__segment_address(segment, index))
+
+  def __store_register(self, segment: str, index: int) -> str:
+    if int(index) <= CodeWriter.MAX_NEAR_INDEX:
+      return CodeWriter.CACHED_POP_NEAR_REG_ASM.format(
+        segment, index, self.__segment_dic[segment], "A=A+1\n" * int(index))
+    return CodeWriter.CACHED_POP_REG_ASM.format(segment, index,
+                                                self.__segment_dic[segment])
 
-  def __bit_op(self, command: str, bit_op: str) -> None:
-    """Writes the assembly code that is the translation of the given bit operation command."""
-    assembly_bit_op = CodeWriter.BIT_OP_ASM.format(command, bit_op)
+  def __push_constant(self, segment: str, index: int) -> str:
+    if int(index) in CodeWriter.SHORT_CONSTANTS:
+      return CodeWriter.PUSH_SHORT_CONST_ASM.format(index)
+    return self.__load_constant(segment, index) + CodeWriter.PUSH_SP_ASM
+
+  def __push(self, segment: str, index: int) -> str:
+    return self.__render("load", segment, index) + CodeWriter.PUSH_SP_ASM
+
+  def __pop_address(self, segment: str, index: int) -> str:
+    return CodeWriter.FILL_ASM + self.__render("store", segment, index)
+
+  def __pop_register(self, segment: str, index: int) -> str:
+    if int(index) > CodeWriter.MAX_NEAR_INDEX:
+      return CodeWriter.POP_REG_ASM.format(segment, index,
+                                           self.__segment_dic[segment])
+    return CodeWriter.FILL_ASM + self.__render("store", segment, index)
+
+  # (operation, segment) -> the method that renders its code, see __render.
+  # The load and store methods pick the shortest code for every index.
+  __emitters = {
+    ("load", "constant"): __load_constant,
+    ("load", "temp"): __load_address, ("load", "pointer"): __load_address,
+    ("load", "static"): __load_address,
+    ("load", "local"): __load_register, ("load", "argument"): __load_register,
+    ("load", "this"): __load_register, ("load", "that"): __load_register,
+    ("store", "temp"): __store_address, ("store", "pointer"): __store_address,
+    ("store", "static"): __store_address,
+    ("store", "local"): __store_register,
+    ("store", "argument"): __store_register,
+    ("store", "this"): __store_register, ("store", "that"): __store_register,
+    ("C_PUSH", "constant"): __push_constant,
+    ("C_PUSH", "temp"): __push, ("C_PUSH", "pointer"): __push,
+    ("C_PUSH", "static"): __push,
+    ("C_PUSH", "local"): __push, ("C_PUSH", "argument"): __push,
+    ("C_PUSH", "this"): __push, ("C_PUSH", "that"): __push,
+    ("C_POP", "temp"): __pop_address, ("C_POP", "pointer"): __pop_address,
+    ("C_POP", "static"): __pop_address,
+    ("C_POP", "local"): __pop_register, ("C_POP", "argument"): __pop_register,
+    ("C_POP", "this"): __pop_register, ("C_POP", "that"): __pop_register}
+
+  def __cached_push(self, segment: str, index: int) -> None:
+    """Writes a push in stack caching mode: the pushed value is loaded to D,
+    after the previous top of the stack is spilled."""
+    self.spill()
+    self.__write(self.__render("load", segment, index))
+    self.__cached = True
+
+  def __cached_pop(self, segment: str, index: int) -> None:
+    """Writes a pop in stack caching mode, which stores D if the top of the
+    stack is cached there."""
+    if not self.__cached:
+      self.__write(self.__render("C_POP", segment, index))
+      return
+    self.__write(self.__render("store", segment, index))
+    self.__cached = False
+
+  def write_move(self, source_segment: str, source_index: int,
+                 segment: str, index: int) -> None:
+    """Writes assembly code that has the effect of "push source_segment
+    source_index" followed by "pop segment index", without going through the
+    stack.
 
-    self.__output_file.write(assembly_bit_op)
+    Args:
+        source_segment (str): the memory segment to read from.
+        source_index (int): the index in the segment to read from.
+        segment (str): the memory segment to write to.
+        index (int): the index in the segment to write to.
+    """
+    self.spill()
+    self.__write(self.__render("load", source_segment, source_index) +
+                 self.__render("store", segment, index))
 
   def __cmp_op(self, command: str) -> None:
-    '''Writes the assembly code that is the translation of the gt arithmetic command.'''
-    asm_command = "J" + command.upper()
-    assembly_gt = CodeWriter.COMPARE_ASM.format(command, CodeWriter.comp_op, asm_command)
-    CodeWriter.comp_op += 1
+    '''Writes the assembly code that is the translation of the given comparison command.'''
+    asm_command = CodeWriter.COMPARE_JUMPS[command]
+    suffix = CodeWriter.GENERATE_COMPARE_SUFFIX.format(self.__file_name,
+                                                       self.__comp_op)
+    self.__comp_op += 1
+    if self.__stack_caching and command == "eq":
+      # shorter than even a call site, and the result stays in D
+      self.__fill()
+      self.__write(CodeWriter.CACHED_EQ_ASM.format(suffix))
+      return
+    self.spill()
+    if self.__size_optimized:
+      assembly_gt = CodeWriter.COMPARE_SITE_ASM.format(
+        command, f"CMP_RETURN{suffix}",
+        CodeWriter.COMPARE_ROUTINE.format(command.upper()))
+    elif command == "eq":
+      assembly_gt = CodeWriter.EQ_ASM.format(command, suffix)
+    else:
+      assembly_gt = CodeWriter.COMPARE_ASM.format(command, suffix, asm_command)
 
-    self.__output_file.write(assembly_gt)
+    self.__write(assembly_gt)
 
   def write_push_pop(self, command: str, segment: str, index: int) -> None:
     """Writes assembly code that is the translation of the given 
@@ -343,104 +769,13 @@ class CodeWriter:
         segment (str): the memory segment to operate on.
         index (int): the index in the memory segment.
     """
-    
-    if command == "C_PUSH":
-      self.__write_push(segment, index)
-    elif command == "C_POP":
-      self.__write_pop(segment, index)
-
-  def __write_pop(self, segment: str, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command, where command is pop'''
-    if segment == "temp":
-      self.__temp_pop(index)
-    elif segment == "static":
-      self.__static_pop(index)
-    elif segment == "pointer":
-      self.__pointer_pop(index)
-    else:
-      self.__reg_pop(segment, index)
-      
-  def __write_push(self, segment: str, index: int) -> None:
-      '''Writes the assembly code that is the translation of the given command, where command is push'''
-      if segment == "constant":
-        self.__constant_push(index)
-      elif segment == "temp" :
-        self.__temp_push(index)
-      elif segment == "static":
-        self.__static_push(index)
-      elif segment == "pointer":
-        self.__pointer_push( index)
-      else:
-        self.__reg_push(segment, index)
-
-  def __pointer_push(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command, where command is
-      C_PUSH and segment is pointer'''
-    assembly_pointer_push = CodeWriter.PUSH_POINTER_ASM.format(index, self.__segment_dic["pointer"])
-
-    self.__output_file.write(assembly_pointer_push)
-
-  def __pointer_pop(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command, where command is
-      C_POP and segment is pointer'''
-    assembly_pointer_pop = CodeWriter.POP_POINTER.format(index, self.__segment_dic["pointer"])
-
-    self.__output_file.write(assembly_pointer_pop)
-
-  def __static_push(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command, where command is
-      C_PUSH and segment is static or pointer'''
-    addr = f"{self.__file_name}.{index}"
-    
-    assembly_static_push = CodeWriter.PUSH_STATIC_ASM.format(index, addr)
-
-    self.__output_file.write(assembly_static_push)
-    
-  def __static_pop(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command,
-      where command is C_POP and segment is pointer or static'''
-    addr = f"{self.__file_name}.{index}"
-
-    assembly_static_pop = CodeWriter.POP_STATIC.format(addr)
-
-    self.__output_file.write(assembly_static_pop)
-
-  def __temp_push(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command,
-      where command is C_PUSH and segment is temp'''
-    assembly_temp_push = CodeWriter.PUSH_TEMP_ASM.format(index, self.__segment_dic["temp"])
-
-    self.__output_file.write(assembly_temp_push)
-
-  def __temp_pop(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command,
-      where command is C_POP and segment is temp'''
-    assembly_temp_pop = CodeWriter.POP_TEMP_ASM.format(index, self.__segment_dic["temp"])
-
-    self.__output_file.write(assembly_temp_pop)
-
-  def __constant_push(self, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command,
-      where command is C_PUSH and segment is constant'''
-    assembly_constant_push = CodeWriter.CONST_PUSH_ASM.format(index)
-    self.__output_file.write(assembly_constant_push)
-
-  def __reg_push(self, segment: str, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command,
-      where command is C_PUSH'''
-    assembly_push = CodeWriter.PUSH_REG_ASM.format(segment,
-                                                index,
-                                                self.__segment_dic[segment])
-
-    self.__output_file.write(assembly_push)
-
-  def __reg_pop(self, segment: str, index: int) -> None:
-    '''Writes the assembly code that is the translation of the given command,
-      where command is C_POP'''
-    assembly_pop = CodeWriter.POP_REG_ASM.format(segment, index,
-                                              self.__segment_dic[segment])
-
-    self.__output_file.write(assembly_pop)
+    if self.__stack_caching:
+      if command == "C_PUSH":
+        self.__cached_push(segment, index)
+      elif command == "C_POP":
+        self.__cached_pop(segment, index)
+      return
+    self.__write(self.__render(command, segment, index))
 
   def write_label(self, label: str) -> None:
     """Writes assembly code that affects the label command. 
@@ -453,7 +788,8 @@ class CodeWriter:
     Args:
         label (str): the label to write.
     """
-    self.__output_file.write(CodeWriter.FUNC_LABEL_ASM.format(self.__current_function, label))
+    self.spill()
+    self.__write(CodeWriter.FUNC_LABEL_ASM.format(self.__current_function, label))
 
   def write_goto(self, label: str) -> None:
     """Writes assembly code that affects the goto command.
@@ -461,9 +797,10 @@ class CodeWriter:
     Args:
         label (str): the label to go to.
     """
+    self.spill()
     assembly_goto = CodeWriter.GOTO_ASM.format(self.__current_function, label)
 
-    self.__output_file.write(assembly_goto)
+    self.__write(assembly_goto)
 
   def write_if(self, label: str) -> None:
     """Writes assembly code that affects the if-goto command. 
@@ -471,9 +808,28 @@ class CodeWriter:
     Args:
         label (str): the label to go to.
     """
+    if self.__cached:
+      # the condition is already in D, and popping it is just forgetting it
+      self.__write(CodeWriter.CACHED_IF_GOTO_ASM.format(
+        self.__current_function, label))
+      self.__cached = False
+      return
     assembly_if = CodeWriter.IF_GOTO_ASM.format(self.__current_function, label)
 
-    self.__output_file.write(assembly_if)
+    self.__write(assembly_if)
+
+  def write_if_not(self, label: str) -> None:
+    """Writes assembly code that has the effect of "not" followed by
+    "if-goto": it jumps unless the popped value is -1 (true).
+
+    Args:
+        label (str): the label to go to.
+    """
+    if not self.__cached:
+      self.__write(CodeWriter.FILL_ASM)
+    self.__write(CodeWriter.IF_NOT_GOTO_ASM.format(
+      self.__current_function, label))
+    self.__cached = False
 
   def write_function(self, function_name: str, n_vars: int) -> None:
     """Writes assembly code that affects the function command. 
@@ -493,10 +849,10 @@ class CodeWriter:
     # (function_name)       // injects a function entry label into the code
     # repeat n_vars times:  // n_vars = number of local variables
     #   push constant 0     // initializes the local variables to 0
+    self.spill()
     self.__current_function = function_name
-    self.__output_file.write(CodeWriter.FUNCTION_LABEL.format(function_name))
-    for i in range(n_vars):
-        self.__constant_push(0)
+    self.__write(CodeWriter.FUNCTION_LABEL.format(function_name) +
+                 CodeWriter.PUSH_SHORT_CONST_ASM.format(0) * int(n_vars))
 
   def write_call(self, function_name: str, n_args: int) -> None:
     """Writes assembly code that affects the call command. 
@@ -518,18 +874,22 @@ class CodeWriter:
     # you will implement this in project 8!
     # The pseudo-code of "call function_name n_args" is:
     # push return_address   // generates a label and pushes it to the stack
-
-    CodeWriter.function_counter += 1
-    return_address = CodeWriter.GENERATE_RETURN_LABEL.format(self.__current_function, CodeWriter.function_counter)
-    command = CodeWriter.PUSH_RETURN_LABEL.format(return_address)
+    self.spill()
+    self.__function_counter += 1
+    # calls outside of any function are namespaced by the file instead
+    return_address = CodeWriter.GENERATE_RETURN_LABEL.format(
+      self.__current_function or self.__file_name, self.__function_counter)
+    if self.__size_optimized:
+      self.__write(CodeWriter.CALL_SITE_ASM.format(
+        function_name, n_args, int(n_args) + 5, return_address))
+      return
+    command = CodeWriter.CALL_ASM.format(function_name, n_args)
+    command += CodeWriter.PUSH_RETURN_LABEL.format(return_address)
     # push LCL              // saves LCL of the caller
-    command += CodeWriter.PUSH_ENV_FIELD.format("LCL")
     # push ARG              // saves ARG of the caller
-    command += CodeWriter.PUSH_ENV_FIELD.format("ARG")
     # push THIS             // saves THIS of the caller
-    command += CodeWriter.PUSH_ENV_FIELD.format("THIS")
     # push THAT             // saves THAT of the caller
-    command += CodeWriter.PUSH_ENV_FIELD.format("THAT")
+    command += CodeWriter.SAVE_FRAME_ASM
     # ARG = SP-5-n_args     // repositions ARG
     command += CodeWriter.SET_NEW_ARG.format(f"{int(n_args) + 5}")
     # LCL = SP              // repositions LCL
@@ -539,7 +899,7 @@ class CodeWriter:
     # (return_address)      // injects the return address label into the code
     command += "(" + return_address + ")\n"
 
-    self.__output_file.write(command)
+    self.__write(command)
 
   def write_return(self) -> None:
     """Writes assembly code that affects the return command."""
@@ -555,25 +915,10 @@ class CodeWriter:
     # ARG = *(frame-3)              // restores ARG for the caller
     # LCL = *(frame-4)              // restores LCL for the caller
     # goto return_address           // go to the return address
+    self.spill()
+    if self.__size_optimized:
+      self.__write(CodeWriter.RETURN_SITE_ASM)
+      return
 
-    # frame = LCL, return_address = *(frame-5)
-    self.__output_file.write(CodeWriter.RET_AND_LCL_ADDRESS_ASM.format())
-    # *ARG = pop()
-    self.__reg_pop("argument", 0)
-    # SP = ARG + 1
-    command = CodeWriter.SP_TO_ARG_PLUS_1_ASM.format()
-    # THAT = *(frame-1)
-    command += CodeWriter.END_FRAME_ASM.format(1, "THAT")
-    # THIS = *(frame-2)
-    command += CodeWriter.END_FRAME_ASM.format(2, "THIS")
-    # ARG = *(frame-3)
-    command += CodeWriter.END_FRAME_ASM.format(3, "ARG")
-    # LCL = *(frame-4)
-    command += CodeWriter.END_FRAME_ASM.format(4, "LCL")
-    # goto return_address
-    command += CodeWriter.RETURN_ASM
-
-    self.__output_file.write(command)
-
-
-    
+    # all of which has no parameters, and is formatted once
+    self.__write(CodeWriter.RETURN_BODY_ASM)
@@ -6,8 +6,11 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
+import functools
+import io
 import os
-import sys
 import typing
 from Parser import Parser
 from CodeWriter import CodeWriter
@@ -16,46 +19,486 @@ from CodeWriter import CodeWriter
 C_ARITHMETIC = "C_ARITHMETIC"
 C_PUSH = "C_PUSH"
 C_POP = "C_POP"
+C_IF = "C_IF"
+
+# command types that only the optimizer produces: a push followed by a pop,
+# and a not followed by an if-goto
+C_MOVE = "C_MOVE"
+C_IF_NOT = "C_IF_NOT"
+
+# the largest constant that a push can load
+MAX_CONSTANT = 32767
+
+# binary arithmetic commands that the optimizer evaluates on constants
+FOLDABLE_COMMANDS = {"add": lambda x, y: x + y,
+                     "sub": lambda x, y: x - y,
+                     "and": lambda x, y: x & y,
+                     "or": lambda x, y: x | y}
+FOLDABLE_UNARY_COMMANDS = {"neg": lambda x: -x, "not": lambda x: ~x}
+
+# the arithmetic commands that pop two values, rather than one
+BINARY_COMMANDS = {"add", "sub", "and", "or", "eq", "gt", "lt"}
+
+# the number of entries of the temp segment, which inlined functions keep
+# their arguments and locals in
+TEMP_SIZE = 8
+
+# a VM command: its type and arguments, or None for missing arguments
+Command = typing.Tuple[str, typing.Any, typing.Any]
+
+# the function that the bootstrap code calls, where whole-program mode
+# starts looking for the functions that are reachable
+ENTRY_FUNCTION = "Sys.init"
+
 
 def translate_file(
-        input_file: typing.TextIO, output_file: typing.TextIO,
-        bootstrap: bool) -> None:
+        input_file: typing.TextIO,
+        output_file: typing.Union[typing.TextIO, typing.BinaryIO, int],
+        bootstrap: bool, size_optimized: bool = False,
+        stack_caching: bool = False, optimize: bool = False) -> None:
     """Translates a single file.
 
     Args:
         input_file (typing.TextIO): the file to translate.
-        output_file (typing.TextIO): writes all output to this file.
+        output_file (typing.Union[typing.TextIO, typing.BinaryIO, int]):
+            writes all output to this file, which may also be a binary file or
+            a file descriptor. The output is buffered, and written in large
+            blocks.
         bootstrap (bool): if this is True, the current file is the 
             first file we are translating.
+        size_optimized (bool): if this is True, comparisons, calls and
+            returns jump into shared routines, which are written along with
+            the bootstrap code (see CodeWriter).
+        stack_caching (bool): if this is True, the top of the stack is kept
+            in D between straight-line commands (see CodeWriter).
+        optimize (bool): if this is True, the commands are rewritten by
+            optimize_commands before they are translated.
     """
     parser = Parser(input_file)
-    code_writer = CodeWriter(output_file)
-
     input_filename, input_extension = os.path.splitext(
         os.path.basename(input_file.name))
-    code_writer.set_file_name(input_filename)
+    translate_commands(input_filename, read_commands(parser), output_file,
+                       bootstrap, size_optimized, stack_caching, optimize)
+
+
+def translate_commands(
+        filename: str, commands: typing.List[Command],
+        output_file: typing.Union[typing.TextIO, typing.BinaryIO, int],
+        bootstrap: bool, size_optimized: bool = False,
+        stack_caching: bool = False, optimize: bool = False) -> None:
+    """Translates the commands of a single file.
+
+    Args:
+        filename (str): the name of the file, without its extension.
+        commands (typing.List[Command]): the commands of the file.
+        output_file (typing.Union[typing.TextIO, typing.BinaryIO, int]):
+            writes all output to this file, see translate_file.
+        bootstrap (bool): see translate_file.
+        size_optimized (bool): see translate_file.
+        stack_caching (bool): see translate_file.
+        optimize (bool): see translate_file.
+    """
+    code_writer = CodeWriter(output_file, size_optimized, stack_caching,
+                             buffered=True)
+    code_writer.set_file_name(filename)
 
     if bootstrap: code_writer.bootstrap()
 
-    while parser.has_more_commands():
-        parser.advance()
-        command_type = parser.command_type()
+    if optimize:
+        commands = optimize_commands(commands)
+    write_commands(commands, code_writer)
+    code_writer.spill()
+    code_writer.flush()
+
+
+def translate_path(input_path: str, size_optimized: bool = False,
+                   stack_caching: bool = False, optimize: bool = False) -> str:
+    """Translates a single file without the bootstrap code. This is what the
+    workers of translate_files run.
+
+    Args:
+        input_path (str): the path of the file to translate.
+        size_optimized (bool): see translate_file.
+        stack_caching (bool): see translate_file.
+        optimize (bool): see translate_file.
+
+    Returns:
+        str: the translation of the file.
+    """
+    output = io.StringIO()
+    with open(input_path, 'r') as input_file:
+        translate_file(input_file, output, False, size_optimized,
+                       stack_caching, optimize)
+    return output.getvalue()
+
+
+def translate_files(
+        input_paths: typing.Sequence[str],
+        output_file: typing.Union[typing.TextIO, typing.BinaryIO, int],
+        jobs: typing.Optional[int] = None, size_optimized: bool = False,
+        stack_caching: bool = False, optimize: bool = False) -> None:
+    """Translates files into a single program that starts with the bootstrap
+    code. The files are translated by a pool of processes, each into a
+    buffer of its own, and the buffers are written in the order of
+    input_paths, so the output does not depend on the number of processes.
+    This works because CodeWriter namespaces the labels it generates by file.
+
+    Args:
+        input_paths (typing.Sequence[str]): the paths of the files.
+        output_file (typing.Union[typing.TextIO, typing.BinaryIO, int]):
+            writes all output to this file, see translate_file.
+        jobs (typing.Optional[int]): the number of processes, or None for
+            the number of CPUs. With a single process, or a single file, the
+            files are translated in this process.
+        size_optimized (bool): see translate_file.
+        stack_caching (bool): see translate_file.
+        optimize (bool): see translate_file.
+    """
+    code_writer = CodeWriter(output_file, size_optimized, stack_caching,
+                             buffered=True)
+    code_writer.bootstrap()
+    translate = functools.partial(
+        translate_path, size_optimized=size_optimized,
+        stack_caching=stack_caching, optimize=optimize)
+    jobs = min(jobs or os.cpu_count() or 1, len(input_paths))
+    if jobs <= 1:
+        for input_path in input_paths:
+            code_writer.write_assembly(translate(input_path))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            for translation in executor.map(translate, input_paths):
+                code_writer.write_assembly(translation)
+    code_writer.flush()
+
+
+def translate_program(
+        input_paths: typing.Sequence[str],
+        output_file: typing.Union[typing.TextIO, typing.BinaryIO, int],
+        size_optimized: bool = False, stack_caching: bool = False,
+        optimize: bool = False, inline_size: int = 0) -> None:
+    """Translates files into a single program like translate_files, but reads
+    all of them first, and leaves out the functions that cannot be reached
+    from ENTRY_FUNCTION (see eliminate_dead_functions).
+
+    Args:
+        input_paths (typing.Sequence[str]): the paths of the files.
+        output_file (typing.Union[typing.TextIO, typing.BinaryIO, int]):
+            writes all output to this file, see translate_file.
+        size_optimized (bool): see translate_file.
+        stack_caching (bool): see translate_file.
+        optimize (bool): see translate_file.
+        inline_size (int): calls to functions of at most this many commands
+            are inlined first, see inline_functions. 0 inlines nothing.
+    """
+    program = []
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            filename, extension = os.path.splitext(
+                os.path.basename(input_path))
+            program.append((filename, read_commands(Parser(input_file))))
+    if inline_size:
+        program = inline_functions(program, inline_size)
+    program = eliminate_dead_functions(program)
+
+    code_writer = CodeWriter(output_file, size_optimized, stack_caching,
+                             buffered=True)
+    code_writer.bootstrap()
+    code_writer.flush()
+    for filename, commands in program:
+        translate_commands(filename, commands, output_file, False,
+                           size_optimized, stack_caching, optimize)
+
+
+def split_functions(commands: typing.List[Command]
+                    ) -> typing.List[typing.List[Command]]:
+    """Splits the commands of a file into functions.
+
+    Args:
+        commands (typing.List[Command]): the commands of a file.
+
+    Returns:
+        typing.List[typing.List[Command]]: the functions, each of them
+        starting with its function command, in order. The commands before
+        the first function, if there are any, come first.
+    """
+    functions = []
+    for command in commands:
+        if command[0] == "C_FUNCTION" or not functions:
+            functions.append([])
+        functions[-1].append(command)
+    return functions
+
+
+def eliminate_dead_functions(
+        program: typing.List[typing.Tuple[str, typing.List[Command]]]
+        ) -> typing.List[typing.Tuple[str, typing.List[Command]]]:
+    """Removes the functions that cannot be reached from ENTRY_FUNCTION,
+    through the calls of the call graph. The VM language has no indirect
+    calls, so the call graph is exact. Commands outside of any function are
+    always kept. A program without ENTRY_FUNCTION is returned as it is.
+
+    Args:
+        program (typing.List[typing.Tuple[str, typing.List[Command]]]): the
+            name and the commands of every file of the program.
+
+    Returns:
+        typing.List[typing.Tuple[str, typing.List[Command]]]: the program,
+        without the dead functions.
+    """
+    program = [(filename, split_functions(commands))
+               for filename, commands in program]
+    calls = {}
+    for filename, functions in program:
+        for function in functions:
+            if function[0][0] == "C_FUNCTION":
+                calls[function[0][1]] = [command[1] for command in function
+                                         if command[0] == "C_CALL"]
+    if ENTRY_FUNCTION not in calls:
+        return [(filename, [command for function in functions
+                            for command in function])
+                for filename, functions in program]
+
+    reachable = {ENTRY_FUNCTION}
+    pending = [ENTRY_FUNCTION]
+    while pending:
+        for callee in calls.get(pending.pop(), ()):
+            if callee not in reachable:
+                reachable.add(callee)
+                pending.append(callee)
+
+    return [(filename, [command for function in functions
+                        if function[0][0] != "C_FUNCTION" or
+                        function[0][1] in reachable
+                        for command in function])
+            for filename, functions in program]
+
+
+def inline_functions(
+        program: typing.List[typing.Tuple[str, typing.List[Command]]],
+        max_size: int) -> typing.List[typing.Tuple[str, typing.List[Command]]]:
+    """Replaces the calls to small leaf functions with their bodies (see
+    inline_call). A function that is not called anymore is left in the
+    program, for eliminate_dead_functions to remove. The inlined code keeps
+    its values in the temp entries that no command of the program uses, so
+    no other code can observe them.
+
+    Args:
+        program (typing.List[typing.Tuple[str, typing.List[Command]]]): the
+            name and the commands of every file of the program.
+        max_size (int): the largest number of commands, not counting the
+            function command, of a function that is inlined.
+
+    Returns:
+        typing.List[typing.Tuple[str, typing.List[Command]]]: the program,
+        with the calls inlined.
+    """
+    functions = {}
+    used_temps = set()
+    for filename, commands in program:
+        for function in split_functions(commands):
+            if function[0][0] == "C_FUNCTION":
+                functions[function[0][1]] = (filename, function)
+        used_temps.update(arg2 for command_type, arg1, arg2 in commands
+                          if arg1 == "temp" and
+                          (command_type == C_PUSH or command_type == C_POP))
+    free_temps = [index for index in range(TEMP_SIZE)
+                  if index not in used_temps]
+
+    expansions = {}
+    inlined = []
+    for filename, commands in program:
+        rewritten = []
+        for command in commands:
+            if command[0] == "C_CALL" and command[1] in functions:
+                key = (filename, command[1], command[2])
+                if key not in expansions:
+                    callee_filename, function = functions[command[1]]
+                    expansions[key] = inline_call(
+                        function, command[2], callee_filename == filename,
+                        max_size, free_temps)
+                if expansions[key] is not None:
+                    rewritten.extend(expansions[key])
+                    continue
+            rewritten.append(command)
+        inlined.append((filename, rewritten))
+    return inlined
+
+
+def inline_call(function: typing.List[Command], n_args: int,
+                same_file: bool, max_size: int, free: typing.List[int]
+                ) -> typing.Optional[typing.List[Command]]:
+    """Expands a call to a function in the frame of the caller.
+
+    Only straight-line functions are inlined: they have no calls, branches
+    or labels, and end with their only return, with just the return value on
+    the stack. The arguments are popped into free temp entries, the locals
+    are kept in others, and THIS and THAT are saved in others if the
+    function sets them, so the caller sees them unchanged as after a return.
+
+    Args:
+        function (typing.List[Command]): the commands of the function,
+            starting with its function command.
+        n_args (int): the number of arguments of the call.
+        same_file (bool): is the call in the file of the function? Static
+            entries belong to the file they are used in.
+        max_size (int): see inline_functions.
+        free (typing.List[int]): the temp entries that the program does not
+            use, which the expansion may overwrite.
+
+    Returns:
+        typing.Optional[typing.List[Command]]: the commands that replace the
+        call, or None if the function cannot be inlined.
+    """
+    n_vars = function[0][2]
+    body = function[1:]
+    if not body or len(body) > max_size or body[-1][0] != "C_RETURN":
+        return None
+    depth = 0
+    saved_pointers = []
+    for command_type, arg1, arg2 in body[:-1]:
+        if command_type == C_PUSH or command_type == C_POP:
+            if arg1 == "static" and not same_file or \
+                    arg1 == "argument" and arg2 >= n_args or \
+                    arg1 == "local" and arg2 >= n_vars:
+                return None
+            if command_type == C_POP and arg1 == "pointer" and \
+                    arg2 not in saved_pointers:
+                saved_pointers.append(arg2)
+            depth += 1 if command_type == C_PUSH else -1
+        elif command_type == C_ARITHMETIC:
+            depth -= arg1 in BINARY_COMMANDS
+        else:
+            return None
+        if depth < 0:
+            return None
+    if depth != 1:
+        return None
+
+    if n_args + n_vars + len(saved_pointers) > len(free):
+        return None
+    slots = {"argument": free[:n_args],
+             "local": free[n_args:n_args + n_vars]}
+    saves = list(zip(saved_pointers, free[n_args + n_vars:]))
+
+    expansion = [(C_POP, "temp", slot) for slot in reversed(slots["argument"])]
+    for slot in slots["local"]:
+        expansion += [(C_PUSH, "constant", 0), (C_POP, "temp", slot)]
+    for pointer, slot in saves:
+        expansion += [(C_PUSH, "pointer", pointer), (C_POP, "temp", slot)]
+    for command_type, arg1, arg2 in body[:-1]:
+        if arg1 in slots and (command_type == C_PUSH or command_type == C_POP):
+            expansion.append((command_type, "temp", slots[arg1][arg2]))
+        else:
+            expansion.append((command_type, arg1, arg2))
+    for pointer, slot in saves:
+        expansion += [(C_PUSH, "temp", slot), (C_POP, "pointer", pointer)]
+    return expansion
+
+
+def read_commands(parser: Parser) -> typing.List[Command]:
+    """Reads all the commands of a file into compact records.
+
+    Args:
+        parser (Parser): a parser at the beginning of the file.
+
+    Returns:
+        typing.List[Command]: the commands of the file.
+    """
+    return list(parser.commands())
+
+
+def optimize_commands(commands: typing.List[Command]) -> typing.List[Command]:
+    """Rewrites patterns that the Jack compiler emits all the time:
+
+    - "push constant a, push constant b, add" (or sub, and, or) becomes
+      "push constant c", as long as c can be pushed as a constant. So does
+      "push constant a, neg" (or not), which is how the Jack compiler writes
+      true (-1), a constant that CodeWriter can push without a command of
+      its own. Chains of these are folded completely.
+    - "push X, pop Y" becomes a single move, that skips the stack.
+    - "not, if-goto L" becomes a single jump that is taken unless the value
+      is true (-1).
+
+    Every pattern is matched against the already rewritten commands, so a
+    label in between always prevents a rewrite.
+
+    Args:
+        commands (typing.List[Command]): the commands of a file.
+
+    Returns:
+        typing.List[Command]: the rewritten commands.
+    """
+    optimized = []
+    for command in commands:
+        command_type, arg1, arg2 = command
+        if command_type == C_ARITHMETIC and arg1 in FOLDABLE_COMMANDS and \
+                len(optimized) >= 2 and \
+                optimized[-1][:2] == optimized[-2][:2] == (C_PUSH, "constant"):
+            value = FOLDABLE_COMMANDS[arg1](optimized[-2][2], optimized[-1][2])
+            if is_pushable(value):
+                optimized[-2:] = [(C_PUSH, "constant", value)]
+                continue
+        elif command_type == C_ARITHMETIC and \
+                arg1 in FOLDABLE_UNARY_COMMANDS and optimized and \
+                optimized[-1][:2] == (C_PUSH, "constant"):
+            value = FOLDABLE_UNARY_COMMANDS[arg1](optimized[-1][2])
+            if is_pushable(value):
+                optimized[-1] = (C_PUSH, "constant", value)
+                continue
+        elif command_type == C_POP and optimized and \
+                optimized[-1][0] == C_PUSH:
+            _, source_segment, source_index = optimized.pop()
+            optimized.append((C_MOVE, (source_segment, source_index),
+                              (arg1, arg2)))
+            continue
+        elif command_type == C_IF and optimized and \
+                optimized[-1] == (C_ARITHMETIC, "not", None):
+            optimized[-1] = (C_IF_NOT, arg1, None)
+            continue
+        optimized.append(command)
+    return optimized
+
+
+def is_pushable(value: int) -> bool:
+    """
+    Args:
+        value (int): the value of a folded constant.
+
+    Returns:
+        bool: True if CodeWriter can write "push constant value".
+    """
+    return 0 <= value <= MAX_CONSTANT or value in CodeWriter.SHORT_CONSTANTS
+
+
+def write_commands(commands: typing.List[Command],
+                   code_writer: CodeWriter) -> None:
+    """Translates commands.
+
+    Args:
+        commands (typing.List[Command]): the commands to translate.
+        code_writer (CodeWriter): writes the translation.
+    """
+    for command_type, arg1, arg2 in commands:
         if command_type == C_ARITHMETIC:
-            code_writer.write_arithmetic(parser.arg1())
+            code_writer.write_arithmetic(arg1)
         elif command_type == C_PUSH or command_type == C_POP:
-            code_writer.write_push_pop(parser.command_type(), parser.arg1(), parser.arg2())
+            code_writer.write_push_pop(command_type, arg1, arg2)
         elif command_type == "C_LABEL":
-            code_writer.write_label(parser.arg1())
+            code_writer.write_label(arg1)
         elif command_type == "C_GOTO":
-            code_writer.write_goto(parser.arg1())
-        elif command_type == "C_IF":
-            code_writer.write_if(parser.arg1())
+            code_writer.write_goto(arg1)
+        elif command_type == C_IF:
+            code_writer.write_if(arg1)
         elif command_type == "C_FUNCTION":
-            code_writer.write_function(parser.arg1(), parser.arg2())
+            code_writer.write_function(arg1, arg2)
         elif command_type == "C_CALL":
-            code_writer.write_call(parser.arg1(), parser.arg2())
+            code_writer.write_call(arg1, arg2)
         elif command_type == "C_RETURN":
             code_writer.write_return()
+        elif command_type == C_MOVE:
+            code_writer.write_move(*arg1, *arg2)
+        elif command_type == C_IF_NOT:
+            code_writer.write_if_not(arg1)
 
 if "__main__" == __name__:
     # Parses the input path and calls translate_file on each input file.
@@ -63,9 +506,36 @@ if "__main__" == __name__:
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    argument_parser = argparse.ArgumentParser(
+        prog="VMtranslator", description="Translates VM code to Hack assembly.")
+    argument_parser.add_argument(
+        "path", help="a .vm file, or a directory of .vm files")
+    argument_parser.add_argument(
+        "--size-optimized", action="store_true",
+        help="share one routine for every comparison, call and return")
+    argument_parser.add_argument(
+        "--stack-caching", action="store_true",
+        help="keep the top of the stack in D between straight-line commands")
+    argument_parser.add_argument(
+        "--optimize", action="store_true",
+        help="fold constants, and fuse push/pop and not/if-goto pairs")
+    argument_parser.add_argument(
+        "--jobs", type=int, default=None, metavar="N",
+        help="translate the files in N processes (default: one per CPU)")
+    argument_parser.add_argument(
+        "--whole-program", action="store_true",
+        help="read all the files first, and leave out the functions that "
+             "are never called (the files are translated in one process)")
+    argument_parser.add_argument(
+        "--inline-size", type=int, default=0, metavar="N",
+        help="in whole-program mode, inline the calls to straight-line "
+             "functions of at most N commands")
+    arguments = argument_parser.parse_args()
+    if arguments.jobs is not None and arguments.whole_program:
+        argument_parser.error("--jobs cannot be combined with --whole-program")
+    if arguments.inline_size and not arguments.whole_program:
+        argument_parser.error("--inline-size requires --whole-program")
+    argument_path = os.path.abspath(arguments.path)
     if os.path.isdir(argument_path):
         files_to_translate = [
             os.path.join(argument_path, filename)
@@ -76,13 +546,16 @@ if "__main__" == __name__:
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
     output_path += ".asm"
-    bootstrap = True
-    with open(output_path, 'w') as output_file:
-        for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
-            with open(input_path, 'r') as input_file:
-                translate_file(input_file, output_file, bootstrap)
-            bootstrap = False
-
+    files_to_translate = sorted(
+        input_path for input_path in files_to_translate
+        if os.path.splitext(input_path)[1].lower() == ".vm")
+    with open(output_path, 'wb') as output_file:
+        if arguments.whole_program:
+            translate_program(files_to_translate, output_file,
+                              arguments.size_optimized,
+                              arguments.stack_caching, arguments.optimize,
+                              arguments.inline_size)
+        else:
+            translate_files(files_to_translate, output_file, arguments.jobs,
+                            arguments.size_optimized,
+                            arguments.stack_caching, arguments.optimize)
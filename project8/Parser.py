@@ -55,33 +55,66 @@ class Parser:
   # command types
   C_ARITHMETIC = "C_ARITHMETIC"
 
+  # the type of every command, and the number of its arguments
+  __command_arities = {**dict.fromkeys(ARITMETIC_COMMAND_LIST,
+                                       (C_ARITHMETIC, 0)),
+                       "pop": ("C_POP", 2), "push": ("C_PUSH", 2),
+                       "label": ("C_LABEL", 1), "goto": ("C_GOTO", 1),
+                       "if-goto": ("C_IF", 1), "function": ("C_FUNCTION", 2),
+                       "return": ("C_RETURN", 0), "call": ("C_CALL", 2)}
+
   def __init__(self, input_file: typing.TextIO) -> None:
-    """Gets ready to parse the input file.
+    """Gets ready to parse the input file. The whole file is tokenized at
+    once, into a (command type, arg1, arg2) tuple for every command.
 
     Args:
         input_file (typing.TextIO): input file.
     """
     self.file = input_file
     self.current_line = -1
-    self.current_command = ''
-
-    # Read lines from input file
-    self.input_lines = self.file.read().splitlines()
-
-    # Remove start and end whitespaces from each line
-    self.input_lines = [line.strip() for line in self.input_lines]
-
-    # Remove tabs
-    self.input_lines = [line.replace('\t', '') for line in self.input_lines]
+    self.current_command = (None, None, None)
+    self.input_commands = list(Parser.tokenize(input_file))
 
-    # Remove empty lines
-    self.input_lines = [line for line in self.input_lines if line]
+  @staticmethod
+  def tokenize(lines: typing.Iterable[str]
+               ) -> typing.Iterator[typing.Tuple[str, typing.Any, typing.Any]]:
+    """Tokenizes VM code lazily, one line at a time, so it also works on
+    streams.
 
-    # Remove lines starting with '/'
-    self.input_lines = [line for line in self.input_lines if not(line.startswith('/'))]
+    Args:
+        lines (typing.Iterable[str]): the lines of the code.
 
-    # Remove comments after valid lines
-    self.input_lines = [line.split('/')[0] for line in self.input_lines]
+    Yields:
+        typing.Tuple[str, typing.Any, typing.Any]: the type of every command,
+        its first argument (the command itself for arithmetic commands) or
+        None, and its second argument as an int or None.
+    """
+    arities = Parser.__command_arities
+    for line in lines:
+      words = line.split("//", 1)[0].split()
+      if not words:
+        continue
+      command_type, arity = arities[words[0]]
+      if arity == 2:
+        yield command_type, words[1], int(words[2])
+      elif arity == 1:
+        yield command_type, words[1], None
+      elif command_type == Parser.C_ARITHMETIC:
+        yield command_type, words[0], None
+      else:
+        yield command_type, None, None
+
+  def commands(self) -> typing.Iterator[
+      typing.Tuple[str, typing.Any, typing.Any]]:
+    """Advances through all the remaining commands.
+
+    Yields:
+        typing.Tuple[str, typing.Any, typing.Any]: every command, as
+        tokenize() yields it.
+    """
+    while self.has_more_commands():
+      self.advance()
+      yield self.current_command
 
   def has_more_commands(self) -> bool:
     """Are there more commands in the input?
@@ -89,7 +122,7 @@ class Parser:
     Returns:
         bool: True if there are more commands, False otherwise.
     """
-    return self.current_line < len(self.input_lines) - 1
+    return self.current_line < len(self.input_commands) - 1
 
   def advance(self) -> None:
     """Reads the next command from the input and makes it the current 
@@ -97,7 +130,7 @@ class Parser:
     there is no current command.
     """
     self.current_line += 1
-    self.current_command = self.input_lines[self.current_line]
+    self.current_command = self.input_commands[self.current_line]
 
   def command_type(self) -> str:
     """
@@ -108,10 +141,7 @@ class Parser:
         "C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION",
         "C_RETURN", "C_CALL".
     """
-    command = self.current_command.split(' ')[0]
-    if command in Parser.ARITMETIC_COMMAND_LIST:
-      return Parser.C_ARITHMETIC
-    return Parser.command_types[command]
+    return self.current_command[0]
 
   def arg1(self) -> str:
     """
@@ -120,10 +150,7 @@ class Parser:
         "C_ARITHMETIC", the command itself (add, sub, etc.) is returned. 
         Should not be called if the current command is "C_RETURN".
     """
-    if self.command_type() == "C_ARITHMETIC":
-      return self.current_command.split(' ')[0]
-    else: 
-      return self.current_command.split(' ')[1]
+    return self.current_command[1]
 
   def arg2(self) -> int:
     """
@@ -132,4 +159,4 @@ class Parser:
         called only if the current command is "C_PUSH", "C_POP", 
         "C_FUNCTION" or "C_CALL".
     """
-    return int(self.current_command.split(' ')[2])
\ No newline at end of file
+    return self.current_command[2]